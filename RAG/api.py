@@ -1,12 +1,25 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 import uvicorn
 from dotenv import load_dotenv
-from config.roles import DEFAULT_ROLE, ROLE_PDF_MAPPING
+from config.roles import DEFAULT_ROLE
 from app import App
 from chat.handler import ChatHandler
+from chat.answer_cache import get_answer_cache
+from chat.session_store import get_session_store
+from config.settings import (
+    DOCUMENTS_DIRECTORY, EMBEDDING_MODEL, LLM_WARMUP, LLM_WARMUP_MAX_RETRY_SECONDS, LLM_WARMUP_RETRY_SECONDS
+)
+from models.ollama_client import warm_up
+from models.registry import loaded_model
+from retrieval.ingestion import document_source
+import asyncio
+import json
 import logging
+import os
 
 # Modelo Pydantic
 class Query(BaseModel):
@@ -18,17 +31,50 @@ class Query(BaseModel):
 class Response(BaseModel):
     answer: str
     context: str
+    chunk_ids: List[Optional[str]] = []
+    scores: List[float] = []
+    timings: Dict[str, float] = {}
+
+class DocumentRequest(BaseModel):
+    path: str               # Ruta del PDF relativa a DOCUMENTS_DIRECTORY
+    roles: List[str] = []   # Vacío: conserva los roles actuales del documento
+
+class DocumentResponse(BaseModel):
+    source: str
+    added: int
+    removed: int
+    unchanged: int
+    roles: List[str]
 
 app = FastAPI(title="RAG API", description="API para el sistema RAG")
 rag_app = None  # se inicializa en startup
+warmup_state = {"ready": False, "error": None}
+warmup_task = None
 
-# Diccionario global para mantener las sesiones por user id
-chat_sessions = {}
+async def warm_up_llm(model_name: str):
+    """
+    Carga el modelo de chat en Ollama; /health informa de que está listo al
+    terminar. Si Ollama aún no responde se reintenta con espera exponencial,
+    y /health pasa a 200 en cuanto un intento tiene éxito.
+    """
+    delay = LLM_WARMUP_RETRY_SECONDS
+    while True:
+        try:
+            warmup_state["seconds"] = await warm_up(model_name)
+        except Exception as e:
+            logging.error("Warm-up of %s failed, retrying in %.0fs: %s", model_name, delay, str(e))
+            warmup_state["error"] = str(e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LLM_WARMUP_MAX_RETRY_SECONDS)
+            continue
+        warmup_state["ready"] = True
+        warmup_state["error"] = None
+        return
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the RAG system when the API starts"""
-    global rag_app, chat_sessions
+    global rag_app
 
     if rag_app is None:
         load_dotenv()
@@ -38,6 +84,23 @@ async def startup_event():
         available_roles = list(rag_app.role_handlers.keys())
         logging.info(f"Initialized handlers for roles: {available_roles}")
 
+        # The warm-up runs in the background so /health can report progress
+        global warmup_task
+        if LLM_WARMUP:
+            warmup_task = asyncio.create_task(warm_up_llm(rag_app.chat_model))
+        else:
+            warmup_state["ready"] = True
+
+def get_session_handler(query: Query) -> ChatHandler:
+    """Return the shared chat handler of the query's role; it keeps one session per userId"""
+    if query.role not in rag_app.role_pdf_mapping:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Invalid role: {query.role}"
+        )
+
+    return rag_app.get_chat_handler(query.role)
+
 @app.post("/query", response_model=Response)
 async def process_query(query: Query):
     """Process a query and return response based on role"""
@@ -45,30 +108,100 @@ async def process_query(query: Query):
         raise HTTPException(status_code=500, detail="System not initialized")
 
     try:
-        if query.role not in ROLE_PDF_MAPPING:
-            raise HTTPException(
-                status_code=403,
-                detail=f"Invalid role: {query.role}"
-            )
-
-        if query.userId in chat_sessions:
-            chat_handler = chat_sessions[query.userId]
-        else:
-            prototype = rag_app.get_chat_handler(query.role)
-            chat_handler = rag_app.initialize_chat_handler(prototype.retrieval_system)
-            chat_sessions[query.userId] = chat_handler
+        chat_handler = get_session_handler(query)
 
-        # Await the async handle_query
-        response_text = await chat_handler.handle_query(query.text, query.userId)
-        context = await chat_handler.get_relevant_context(query.text, query.userId)
-        return Response(answer=response_text, context=context)
+        # Retrieval runs once; the result carries the context it used
+        result = await chat_handler.handle_query(query.text, query.userId)
+        return Response(
+            answer=result.answer,
+            context=result.context,
+            chunk_ids=result.chunk_ids,
+            scores=result.scores,
+            timings=result.timings
+        )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def stream_query(query: Query):
+    """Stream the answer as Server-Sent Events: context first, then tokens"""
+    if not rag_app:
+        raise HTTPException(status_code=500, detail="System not initialized")
+
+    chat_handler = get_session_handler(query)
+
+    async def events():
+        async for event in chat_handler.stream_query(query.text, query.userId):
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def resolve_document_path(path: str) -> str:
+    """
+    Ruta con la que se indexa un PDF pedido por la API. Solo se aceptan PDFs
+    dentro de DOCUMENTS_DIRECTORY: cualquier otro fichero legible del
+    servidor quedaría accesible para los roles asignados.
+    """
+    base = os.path.realpath(DOCUMENTS_DIRECTORY)
+    resolved = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, resolved]) != base or not resolved.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail=f"Path must be a PDF inside the documents directory: {path}")
+    return document_source(resolved)
+
+@app.post("/documents", response_model=DocumentResponse)
+async def add_document(document: DocumentRequest):
+    """Add or replace one PDF in the index without rebuilding it"""
+    if not rag_app:
+        raise HTTPException(status_code=500, detail="System not initialized")
+
+    path = resolve_document_path(document.path)
+    try:
+        stats = await run_in_threadpool(rag_app.add_document, path, document.roles)
+        return DocumentResponse(**stats)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"File not found: {document.path}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents", response_model=DocumentResponse)
+async def remove_document(path: str):
+    """Remove one PDF from the index without rebuilding it"""
+    if not rag_app:
+        raise HTTPException(status_code=500, detail="System not initialized")
+
+    path = resolve_document_path(path)
+    try:
+        stats = await run_in_threadpool(rag_app.remove_document, path)
+        return DocumentResponse(**stats)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas del proceso: sesiones, caché de respuestas y caché de embeddings de consultas"""
+    # Sin cargar el modelo: si falló al arrancar, cargarlo aquí bloquearía el bucle de eventos
+    embeddings = loaded_model("embedding", EMBEDDING_MODEL)
+    return {
+        "sessions": get_session_store().metrics(),
+        "answer_cache": get_answer_cache().metrics(),
+        "query_embeddings": {
+            "hits": embeddings.hits, "misses": embeddings.misses, "entries": len(embeddings.cache)
+        } if embeddings is not None else None,
+    }
+
 @app.get("/health")
 async def health_check():
-    """Endpoint para verificar el estado de la API"""
+    """Endpoint para verificar el estado de la API: 503 hasta que el modelo de chat está cargado"""
+    if rag_app is None or not warmup_state["ready"]:
+        status = "ERROR" if warmup_state["error"] else "STARTING"
+        return JSONResponse(status_code=503, content={"status": status, "detail": warmup_state["error"]})
     return {"status": "OK"}
 
 if __name__ == "__main__":
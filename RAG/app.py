@@ -1,9 +1,11 @@
 from dotenv import load_dotenv
 import logging
-from loaders.pdf_loader import PDFLoaderService
-from retrieval.retrieval_system import RetrievalSystem
+from retrieval.index_store import IndexStore
+from retrieval.ingestion import IngestionService, open_retrieval_system, resolve_role_pdf_mapping
 from chat.handler import ChatHandler
-from config.roles import ROLE_PDF_MAPPING, DEFAULT_ROLE
+from config.roles import DEFAULT_ROLE
+from config.settings import CHUNK_OVERLAP, CHUNK_SIZE, CROSS_ENCODER_MODEL, EMBEDDING_MODEL, INDEX_DIRECTORY
+from models.backends import embedding_model_id
 import os
 
 
@@ -20,100 +22,94 @@ class App:
                 load_dotenv()
                 logging.basicConfig(level=logging.INFO)
                 self.logger = logging.getLogger(__name__)
-                self.embedding_model = "voyage-multilingual-2"
+                self.embedding_model = embedding_model_id(EMBEDDING_MODEL)
                 self.chat_model = os.getenv("CHAT_MODEL", "llama3.2")
-                self.chunk_size = int(os.getenv("CHUNK_SIZE", 1000))
-                self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", 200))
+                self.chunk_size = CHUNK_SIZE
+                self.chunk_overlap = CHUNK_OVERLAP
+                # ROLE_PDF_MAPPING plus documents added or removed through ingestion
+                self.role_pdf_mapping = resolve_role_pdf_mapping(
+                    IndexStore(INDEX_DIRECTORY).load_ingestion()
+                )
                 self.role_handlers = {}
+                self.retrieval_system = None
+                self.ingestion_service = None
                 self.initialize_role_handlers()
                 self._initialized = True
     def initialize_role_handlers(self):
         """Initialize handlers for all roles at startup"""
-        for role in ROLE_PDF_MAPPING.keys():
-            try:
-                self.logger.info(f"Initializing handler for role: {role}")
-
-                # Get allowed PDFs for the role
-                allowed_pdfs = self.get_pdf_files_for_role(role)
-
-                # Initialize loader with allowed PDFs
-                loader_service = PDFLoaderService(
-                    pdf_files=allowed_pdfs,
-                    chunk_size=self.chunk_size,
-                    chunk_overlap=self.chunk_overlap
-                )
-
-                # Load documents
-                docs = loader_service.load_pdfs()
+        # A single index holds the chunks of every PDF; roles only filter it
+        self.retrieval_system = self.initialize_retrieval_system()
+        if self.retrieval_system is None:
+            self.logger.warning("No documents found for any role")
+            return
+        self.ingestion_service = IngestionService(
+            self.retrieval_system,
+            self.role_pdf_mapping,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap
+        )
 
-                if not docs:
-                    self.logger.warning(f"No documents found for role: {role}")
-                    continue
+        for role in list(self.role_pdf_mapping.keys()):
+            self.initialize_role_handler(role)
+    def initialize_role_handler(self, role: str):
+        """Create and store the chat handler for one role"""
+        try:
+            self.logger.info(f"Initializing handler for role: {role}")
 
-                # Create role-specific retrieval system
-                retrieval_system = self.initialize_retrieval_system(docs, role)
-                chat_handler = self.initialize_chat_handler(retrieval_system)
+            role_retrieval = self.get_role_retrieval(role)
+            chat_handler = self.initialize_chat_handler(role_retrieval)
 
-                # Store the handler
-                self.role_handlers[role] = chat_handler
-                self.logger.info(f"Successfully initialized handler for role: {role}")
+            # Store the handler
+            self.role_handlers[role] = chat_handler
+            self.logger.info(f"Successfully initialized handler for role: {role}")
 
-            except Exception as e:
-                self.logger.error(f"Error initializing handler for role {role}: {str(e)}")
+        except Exception as e:
+            self.logger.error(f"Error initializing handler for role {role}: {str(e)}")
     def get_pdf_files_for_role(self, role: str) -> list:
         """Get the list of PDF files accessible for a specific role"""
-        if role not in ROLE_PDF_MAPPING:
+        if role not in self.role_pdf_mapping:
             self.logger.warning(f"Unknown role: {role}. Using default role.")
             role = DEFAULT_ROLE
-        return ROLE_PDF_MAPPING[role]
+        return self.role_pdf_mapping[role]
+
+    def get_all_pdf_files(self) -> list:
+        """Get every PDF referenced by any role, each listed once"""
+        return sorted({pdf for pdfs in self.role_pdf_mapping.values() for pdf in pdfs})
 
-    def initialize_loader_service(self, role: str):
-        """Initialize loader service for a specific role"""
-        pdf_files = self.get_pdf_files_for_role(role)
-        return PDFLoaderService(
-            pdf_files=pdf_files,
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap
-        )
     def get_or_create_role_loader(self, role: str):
         """Get or create a loader for a specific role"""
         try:
-            # Always create a new loader for each request to ensure fresh document access
-            # Get allowed PDFs for the role
-            allowed_pdfs = self.get_pdf_files_for_role(role)
-
-            # Initialize loader with only allowed PDFs
-            loader_service = PDFLoaderService(
-                pdf_files=allowed_pdfs,
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap
-            )
+            if self.retrieval_system is None:
+                self.retrieval_system = self.initialize_retrieval_system()
 
-            # Load only allowed documents
-            docs = loader_service.load_pdfs()
-
-            if not docs:
+            if self.retrieval_system is None:
                 self.logger.warning(f"No accessible documents found for role: {role}")
                 return None
 
-            # Create role-specific retrieval system
-            retrieval_system = self.initialize_retrieval_system(docs, role)
-            chat_handler = self.initialize_chat_handler(retrieval_system)
-
-            return chat_handler
+            return self.initialize_chat_handler(self.get_role_retrieval(role))
 
         except Exception as e:
             self.logger.error(f"Error creating loader for role {role}: {str(e)}")
             return None
 
-    def initialize_retrieval_system(self, all_docs, role):
-            return RetrievalSystem(all_docs, role)
+    def initialize_retrieval_system(self):
+        """Open the shared index from disk and update changed PDFs, or build it"""
+        return open_retrieval_system(
+            self.get_all_pdf_files(),
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            embedding_model=self.embedding_model
+        )
+
+    def get_role_retrieval(self, role: str):
+        """Get a view of the shared index restricted to the role's PDFs"""
+        return self.retrieval_system.for_role(role, self.get_pdf_files_for_role(role))
 
     def initialize_chat_handler(self, retrieval_system):
         return ChatHandler(
             retrieval_system=retrieval_system,
             chat_model=self.chat_model,
-            cross_encoder_model='cross-encoder/ms-marco-MiniLM-L-6-v2'
+            cross_encoder_model=CROSS_ENCODER_MODEL
         )
     def get_chat_handler(self, role: str):
         """Get the appropriate chat handler for a role"""
@@ -121,3 +117,19 @@ class App:
             self.logger.warning(f"No handler found for role: {role}. Using default role.")
             role = DEFAULT_ROLE
         return self.role_handlers.get(role)
+
+    def add_document(self, pdf_file: str, roles: list = None) -> dict:
+        """Add or replace one PDF in the shared index without rebuilding it"""
+        if self.ingestion_service is None:
+            raise RuntimeError("Retrieval system not initialized")
+        stats = self.ingestion_service.add_document(pdf_file, roles)
+        for role in stats["roles"]:
+            if role not in self.role_handlers:
+                self.initialize_role_handler(role)
+        return stats
+
+    def remove_document(self, pdf_file: str) -> dict:
+        """Remove one PDF from the shared index without rebuilding it"""
+        if self.ingestion_service is None:
+            raise RuntimeError("Retrieval system not initialized")
+        return self.ingestion_service.remove_document(pdf_file)
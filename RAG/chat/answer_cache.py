@@ -0,0 +1,135 @@
+from typing import Dict, Hashable, Optional, Sequence
+import bisect
+import logging
+import re
+import time
+import unicodedata
+
+import numpy as np
+from cachetools import TTLCache
+
+from config.settings import (
+    ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD
+)
+
+
+PUNCTUATION = re.compile(r"[¿?¡!.,;:\"'()]+")
+
+
+def normalize_query(query: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación y con los espacios colapsados."""
+    query = unicodedata.normalize("NFKD", query.lower())
+    query = "".join(char for char in query if not unicodedata.combining(char))
+    return " ".join(PUNCTUATION.sub(" ", query).split())
+
+
+class AnswerCache:
+    """
+    Caché de respuestas en dos niveles:
+
+    - exacta: por rol, versión del índice del rol y consulta normalizada;
+    - semántica (opcional): devuelve la respuesta de una consulta anterior
+      del mismo rol cuyo embedding tenga similitud coseno >= `threshold`.
+
+    Las entradas de un rol se descartan en cuanto cambia la versión de su
+    índice, así que nunca se sirve una respuesta basada en documentos
+    modificados o eliminados. Ambos niveles caducan a los `ttl_seconds`.
+    """
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 semantic: bool = SEMANTIC_CACHE_ENABLED, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 semantic_size: int = SEMANTIC_CACHE_SIZE):
+        self.exact = TTLCache(maxsize=max_size, ttl=ttl_seconds)
+        self.ttl = ttl_seconds
+        self.semantic = semantic
+        self.threshold = threshold
+        self.semantic_size = semantic_size
+        # rol -> {"vectors" (n, d) normalizados, "results", "expires"}, en orden de inserción
+        self._semantic_entries: Dict[str, dict] = {}
+        self._versions: Dict[str, Hashable] = {}
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _check_version(self, role: str, version: Hashable):
+        if self._versions.get(role, version) != version:
+            for key in [key for key in self.exact.keys() if key[0] == role]:
+                self.exact.pop(key, None)
+            self._semantic_entries.pop(role, None)
+            self.stats["invalidations"] += 1
+            logging.info("Answer cache invalidated for role %s", role)
+        self._versions[role] = version
+
+    def get(self, role: str, version: Hashable, query: str, embedding: Optional[Sequence[float]] = None):
+        self._check_version(role, version)
+        result = self.exact.get((role, version, normalize_query(query)))
+        if result is not None:
+            self.stats["exact_hits"] += 1
+            return result
+        entries = self._semantic_entries_of(role)
+        if embedding is not None and entries is not None:
+            similarities = entries["vectors"] @ self._unit(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.stats["semantic_hits"] += 1
+                return entries["results"][best]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, role: str, version: Hashable, query: str, result, embedding: Optional[Sequence[float]] = None):
+        # Respuesta calculada con una versión del índice que ya cambió
+        if self._versions.setdefault(role, version) != version:
+            return
+        self.exact[(role, version, normalize_query(query))] = result
+        if embedding is None:
+            return
+        entries = self._semantic_entries_of(role)
+        if entries is None:
+            entries = self._semantic_entries[role] = {"vectors": None, "results": [], "expires": []}
+        vector = self._unit(embedding)[None, :]
+        entries["vectors"] = vector if entries["vectors"] is None else np.vstack([entries["vectors"], vector])
+        entries["results"].append(result)
+        entries["expires"].append(time.monotonic() + self.ttl)
+        if len(entries["results"]) > self.semantic_size:
+            entries["vectors"] = entries["vectors"][1:]
+            entries["results"].pop(0)
+            entries["expires"].pop(0)
+
+    def _semantic_entries_of(self, role: str) -> Optional[dict]:
+        """Entradas semánticas vigentes del rol; las caducadas son siempre las más antiguas."""
+        entries = self._semantic_entries.get(role)
+        if entries is None:
+            return None
+        expired = bisect.bisect_right(entries["expires"], time.monotonic())
+        if expired == len(entries["results"]):
+            del self._semantic_entries[role]
+            return None
+        if expired:
+            entries["vectors"] = entries["vectors"][expired:]
+            del entries["results"][:expired]
+            del entries["expires"][:expired]
+        return entries
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def metrics(self) -> dict:
+        lookups = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            entries=len(self.exact),
+            semantic_entries=sum(len(entries["results"]) for entries in self._semantic_entries.values()),
+            hit_rate=(self.stats["exact_hits"] + self.stats["semantic_hits"]) / lookups if lookups else 0.0,
+        )
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """Caché de respuestas del proceso, compartida por todos los roles."""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
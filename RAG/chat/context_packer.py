@@ -0,0 +1,103 @@
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from config.settings import CHUNK_OVERLAP, CONTEXT_MAX_CHUNKS, HISTORY_PROMPT_SHARE, PROMPT_TOKEN_BUDGET
+from utils.tokens import TokenCounter, get_token_counter
+
+
+# Solape mínimo (caracteres) para considerar que dos fragmentos se solapan
+MIN_OVERLAP = 20
+
+
+@dataclass
+class PackedContext:
+    context: str
+    chat_history: str
+    chunk_ids: List[Optional[str]] = field(default_factory=list)
+    scores: List[float] = field(default_factory=list)
+    tokens: int = 0
+
+
+class ContextPacker:
+    """
+    Ajusta contexto, historial y pregunta a un presupuesto de tokens.
+
+    Los fragmentos se eligen por puntuación hasta llenar el presupuesto,
+    pero se colocan en el orden del documento (posición en el índice): el
+    mismo conjunto de fragmentos produce siempre el mismo prefijo de prompt,
+    que Ollama puede reutilizar de la caché KV, y los fragmentos contiguos
+    de un PDF quedan juntos para eliminar el texto repetido por CHUNK_OVERLAP.
+    """
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET, overhead_tokens: int = 0,
+                 max_chunks: int = CONTEXT_MAX_CHUNKS, history_share: float = HISTORY_PROMPT_SHARE,
+                 max_overlap: int = CHUNK_OVERLAP, counter: Optional[TokenCounter] = None):
+        self.budget = budget
+        self.overhead_tokens = overhead_tokens
+        self.max_chunks = max_chunks
+        self.history_share = history_share
+        self.max_overlap = max_overlap
+        self.counter = counter or get_token_counter()
+
+    def _available(self, question: str) -> int:
+        return self.budget - self.overhead_tokens - self.counter.count(question)
+
+    def fit_history(self, history: str, question: str) -> str:
+        """Historial recortado (se conservan los turnos más recientes)."""
+        limit = int(max(self._available(question), 0) * self.history_share)
+        return self.counter.truncate(history, limit, keep_end=True)
+
+    def overlap(self, previous: str, text: str) -> int:
+        """Longitud del final de `previous` que se repite al principio de `text`."""
+        for size in range(min(len(previous), len(text), self.max_overlap), MIN_OVERLAP - 1, -1):
+            if previous.endswith(text[:size]):
+                return size
+        return 0
+
+    def pack(self, candidates: Sequence[Tuple[int, Document, float]], question: str, history: str) -> PackedContext:
+        """
+        `candidates` son (posición en el índice, documento, puntuación) de
+        mayor a menor puntuación.
+        """
+        history = self.fit_history(history, question)
+        available = self._available(question) - self.counter.count(history)
+
+        selected = []
+        used = 0
+        for position, doc, score in candidates:
+            if len(selected) >= self.max_chunks:
+                break
+            text = doc.page_content
+            tokens = self.counter.count(text)
+            if used + tokens > available:
+                if selected or available <= 0:
+                    continue
+                # Al menos un fragmento, aunque sea recortado
+                text = self.counter.truncate(text, available)
+                tokens = self.counter.count(text)
+            selected.append((position, doc, score, text))
+            used += tokens
+
+        passages: List[str] = []
+        previous = None
+        for position, doc, score, text in sorted(selected, key=lambda item: item[0]):
+            if previous is not None and previous.metadata.get("source") == doc.metadata.get("source"):
+                size = self.overlap(passages[-1], text)
+                if size:
+                    passages[-1] += text[size:]
+                    previous = doc
+                    continue
+            passages.append(text)
+            previous = doc
+
+        context = "\n".join(passages)
+        ordered = sorted(selected, key=lambda item: item[0])
+        return PackedContext(
+            context=context,
+            chat_history=history,
+            chunk_ids=[doc.metadata.get("chunk_id") for _, doc, _, _ in ordered],
+            scores=[float(score) for _, _, score, _ in ordered],
+            tokens=self.overhead_tokens + self.counter.count(question) + self.counter.count(history)
+            + self.counter.count(context),
+        )
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from config.settings import STAGE_CONCURRENCY
+
+
+class StageExecutor:
+    """
+    Ejecuta el trabajo bloqueante de una etapa del pipeline (búsqueda
+    vectorial, BM25L, TF-IDF, reranking) en un pool de hilos propio, fuera
+    del bucle de eventos, con un límite de peticiones simultáneas.
+
+    Los modelos y los índices liberan el GIL en su mayor parte (torch,
+    numpy, scipy) y no son serializables, por eso se usan hilos y no procesos.
+    """
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"rag-{name}")
+        # Acota también las peticiones en espera, no solo los hilos ocupados
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+
+
+_executors: Dict[str, StageExecutor] = {}
+_llm_semaphore = None
+
+
+def get_executor(stage: str) -> StageExecutor:
+    """
+    Devuelve el executor compartido (uno por proceso) de la etapa dada.
+    """
+    if stage not in _executors:
+        _executors[stage] = StageExecutor(stage, STAGE_CONCURRENCY[stage])
+        logging.info("Executor for stage %s: %d concurrent calls", stage, STAGE_CONCURRENCY[stage])
+    return _executors[stage]
+
+
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """
+    Límite de generaciones simultáneas contra Ollama. Las llamadas al LLM ya
+    son asíncronas, así que no necesitan pool de hilos.
+    """
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(STAGE_CONCURRENCY["llm"])
+    return _llm_semaphore
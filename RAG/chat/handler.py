@@ -1,56 +1,80 @@
 import asyncio
 import json
 import logging
-from typing import List, Tuple
-import heapq
+import time
+from dataclasses import dataclass, field, replace
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
 from langchain.schema import Document
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.prompts import ChatPromptTemplate
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain_ollama import OllamaLLM
-from sentence_transformers import CrossEncoder
-from retrieval.retrieval_system import RetrievalSystem  # Asegúrate de que la ruta es correcta
+from retrieval.fusion import fuse
+from retrieval.retrieval_system import RoleRetrievalView
+from chat.answer_cache import get_answer_cache
+from chat.context_packer import ContextPacker
+from chat.executors import get_executor, get_llm_semaphore
+from chat.reranker import get_reranker
+from chat.session import ChatSession
+from chat.session_store import get_session_store
+from models.registry import get_embeddings, get_llm
+from utils.tokens import get_token_counter
+from config.settings import EMBEDDING_MODEL, FUSION_METHOD, FUSION_WEIGHTS, RETRIEVAL_TIMEOUTS, RRF_K
+
+
+@dataclass
+class RetrievalResult:
+    """
+    Resultado de la recuperación híbrida para una consulta.
+    """
+    context: str
+    chunk_ids: List[Optional[str]] = field(default_factory=list)
+    scores: List[float] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Historial recortado al presupuesto del prompt
+    chat_history: str = ""
+
+
+@dataclass
+class QueryResult:
+    """
+    Respuesta a una consulta junto con el contexto y las métricas de la
+    recuperación que la produjo.
+    """
+    answer: str
+    context: str
+    chunk_ids: List[Optional[str]] = field(default_factory=list)
+    scores: List[float] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+
 
 class ChatHandler:
     """
-    Manejador de interacciones de chat con el usuario.
+    Manejador de interacciones de chat de un rol. Se comparte entre todos
+    los usuarios del rol: los modelos vienen del registro del proceso y el
+    estado de cada usuario vive en su ChatSession.
     """
-    def __init__(self, retrieval_system: RetrievalSystem, chat_model: str, cross_encoder_model: str):
+    def __init__(self, retrieval_system: RoleRetrievalView, chat_model: str, cross_encoder_model: str):
         self.retrieval_system = retrieval_system
         self.chat_model = chat_model
-        self.cross_encoder = CrossEncoder(cross_encoder_model)
+        self.reranker = get_reranker(cross_encoder_model)
         self.logger = logging.getLogger(__name__)
-        self.llm = OllamaLLM(
-            model=self.chat_model,
-            temperature=0.0,
-            callbacks=[StreamingStdOutCallbackHandler()],
-            base_url="http://localhost:11434"
-        )
-        self.memory = ConversationSummaryBufferMemory(
-            llm=self.llm,
-            max_token_limit=50,
-            input_key="question",
-            memory_key="chat_history",
-            return_messages=True
-        )
+        self.llm = get_llm(self.chat_model)
         self.prompt = ChatPromptTemplate.from_messages([
             ("system", "You are a helpful assistant. Use the following context to answer the question in Spanish, paying close attention to the question details, thinking step by step, and providing a complete response. if context is not related to the question, you must only say: i dont have acces to that information"),
             ("human", "Context: {context}"),
             ("human", "Chat history: {chat_history}"),
             ("human", "Question: {question}")
         ])
-        self.chain = (
-            {
-                "context": RunnablePassthrough(),
-                "question": RunnablePassthrough(),
-                "chat_history": lambda x: self.memory.load_memory_variables({})["chat_history"]
-            }
-            | self.prompt
-            | self.llm
+        # El historial se pasa en cada llamada: la memoria es de cada sesión
+        self.chain = self.prompt | self.llm
+        self.packer = ContextPacker(
+            overhead_tokens=get_token_counter().count(self.prompt.format(context="", question="", chat_history=""))
         )
-        # Diccionario para almacenar por userId el historial de mensajes
-        self.sessions = {}
+        # Almacén de sesiones del proceso (compartido por todos los roles)
+        self.sessions = get_session_store()
+        self.answer_cache = get_answer_cache()
+        # Sesiones con un resumen del historial en curso y sus tareas (el
+        # bucle de eventos solo guarda referencias débiles a las tareas)
+        self._summarizing = set()
+        self._summary_tasks = set()
 
     def __del__(self):
         """Cleanup when the handler is destroyed"""
@@ -62,6 +86,49 @@ class ChatHandler:
                 except:
                     pass
 
+    def session_key(self, userId: str) -> str:
+        return f"{self.retrieval_system.role}:{userId}"
+
+    def _new_session(self, key: str) -> ChatSession:
+        return ChatSession.create(key.split(":", 1)[1])
+
+    def get_session(self, userId: str) -> ChatSession:
+        return self.sessions.get_or_create(self.session_key(userId), self._new_session)
+
+    def save_session(self, userId: str, session: ChatSession):
+        key = self.session_key(userId)
+        self.sessions.put(key, session)
+        if session.history.overflow() and key not in self._summarizing:
+            self._summarizing.add(key)
+            task = asyncio.get_running_loop().create_task(self.summarize_history(key))
+            self._summary_tasks.add(task)
+            task.add_done_callback(self._summary_tasks.discard)
+
+    def record_turn(self, session: ChatSession, question: str, answer: str):
+        session.history.add_turn(question, answer)
+        session.add_message("assistant", answer)
+
+    async def summarize_history(self, key: str):
+        """
+        Resume en segundo plano los turnos que exceden el presupuesto del
+        historial; la respuesta al usuario no espera a esta llamada al LLM.
+        """
+        try:
+            session = self.sessions.get(key, self._new_session)
+            turns = session.history.overflow() if session is not None else []
+            if not turns:
+                return
+            async with get_llm_semaphore():
+                summary = await self.llm.ainvoke(session.history.summary_prompt(turns))
+            # La sesión pudo cambiar (o releerse del almacén) mientras tanto
+            current = self.sessions.get(key, self._new_session)
+            if current is not None and current.history.apply_summary(summary, turns):
+                self.sessions.put(key, current)
+        except Exception as e:
+            logging.error("Error resumiendo el historial de %s: %s", key, str(e))
+        finally:
+            self._summarizing.discard(key)
+
     def weight_chat_history(self, messages: List[dict], max_messages: int = 2, decay_factor: float = 0.9) -> str:
         recent_history = messages[-max_messages:]
         weighted_history = []
@@ -70,100 +137,318 @@ class ChatHandler:
             weighted_history.append(f"{weight:.2f} * {message['content']}")
         return " ".join(reversed(weighted_history))
 
-    async def get_relevant_context(self, query: str, userId: str) -> str:
-        # Obtener o inicializar la sesión de mensajes
-        session_messages = self.sessions.get(userId, [])
-        weighted_history = self.weight_chat_history(session_messages)
-        combined_query = f"{query} {weighted_history}"
+    def retrieval_query(self, query: str, session: Optional[ChatSession]) -> str:
+        """
+        Consulta de recuperación: la pregunta seguida del historial reciente
+        ponderado. En el primer turno (el único mensaje es la propia
+        pregunta) es la pregunta sola, la misma cadena que embebe la caché
+        de respuestas, así que su embedding se calcula una sola vez.
+        """
+        messages = session.messages if session else []
+        if len(messages) <= 1 and not (session and (session.history.turns or session.history.summary)):
+            return query
+        return f"{query} {self.weight_chat_history(messages)}"
 
-        vector_results = await self.vector_search(combined_query)
-        bm25l_results = await self.bm25l_search(combined_query)
+    @staticmethod
+    def is_cacheable(session: ChatSession) -> bool:
+        """
+        La caché de respuestas solo se usa para la primera pregunta de una
+        conversación: después, el historial amplía la consulta de
+        recuperación y entra en el prompt, y la respuesta de otro usuario a
+        la misma pregunta no vale.
+        """
+        return not session.has_history()
+
+    async def cached_answer(self, query: str) -> Tuple[Optional[QueryResult], Optional[List[float]], Hashable]:
+        """
+        Busca la consulta en la caché de respuestas del rol. Devuelve
+        (resultado o None, embedding de la consulta si la caché semántica
+        está activa, versión del índice del rol) para guardar después la
+        respuesta con la misma versión. El embedding es el de la consulta de
+        recuperación del primer turno y se reutiliza en la búsqueda vectorial.
+        """
+        version = self.retrieval_system.index_version
+        embedding = None
+        if self.answer_cache.semantic:
+            embedding = await get_executor("vector").run(
+                get_embeddings(EMBEDDING_MODEL).embed_query, query
+            )
+        result = self.answer_cache.get(self.retrieval_system.role, version, query, embedding)
+        return result, embedding, version
+
+    async def retrieve(self, query: str, userId: str, session: Optional[ChatSession] = None,
+                       embedding: Optional[List[float]] = None) -> RetrievalResult:
+        """
+        Ejecuta una vez la recuperación híbrida (vectorial, BM25L, TF-IDF y
+        reranking) y devuelve el contexto junto con los ids, puntuaciones y
+        tiempos de cada etapa. `session` evita volver a leerla del almacén;
+        `embedding` es el de `query` si ya se calculó para la caché.
+        """
+        started = time.perf_counter()
+        timings = {}
+        if session is None:
+            session = self.sessions.get(self.session_key(userId), self._new_session)
+        combined_query = self.retrieval_query(query, session)
+        if combined_query != query:
+            embedding = None
+        chat_history = session.chat_history() if session else ""
+        # Todas las etapas leen el mismo estado del índice, aunque entretanto
+        # se ingieran o eliminen documentos
+        view = self.retrieval_system.pin()
+
+        # Las tres ramas son independientes: se lanzan a la vez y una rama
+        # lenta o caída se descarta al vencer su timeout.
+        vector_results, bm25l_results, tfidf_query = await asyncio.gather(
+            self._run_branch("vector", self.vector_search(combined_query, view, embedding), [], timings),
+            self._run_branch("bm25l", self.bm25l_search(combined_query, view), [], timings),
+            self._run_branch("tfidf", self.tfidf_search(combined_query, view), None, timings),
+        )
 
         if not vector_results and not bm25l_results:
             logging.warning("Ambas búsquedas, vectorial y BM25L, fallaron. Recurriendo a búsqueda por palabras clave.")
-            return await self.fallback_keyword_search(combined_query)
+            context = self.fallback_keyword_search(combined_query)
+            timings["retrieval"] = time.perf_counter() - started
+            return RetrievalResult(
+                context=context,
+                timings=timings,
+                chat_history=self.packer.fit_history(chat_history, query)
+            )
+
+        stage = time.perf_counter()
+        top_results = self.fuse_results(vector_results, bm25l_results, tfidf_query, view)[:10]
+        timings["fusion"] = time.perf_counter() - stage
+
+        docs = view.docs
+        candidates = [docs[view.position(chunk_id)] for chunk_id, _ in top_results]
+        stage = time.perf_counter()
+        reranked = await self.rerank_results(candidates, combined_query, [score for _, score in top_results])
+        timings["rerank"] = time.perf_counter() - stage
 
-        combined_results = []
-        for doc in vector_results:
-            heapq.heappush(combined_results, (-0.6, doc.page_content))
+        # Los mejores fragmentos que caben en el presupuesto del prompt
+        packed = self.packer.pack(
+            [(view.position(top_results[i][0]), candidates[i], score) for i, score in reranked],
+            query,
+            chat_history
+        )
+        self.logger.info("Prompt de ~%d tokens con %d fragmentos", packed.tokens, len(packed.chunk_ids))
+        timings["retrieval"] = time.perf_counter() - started
+        return RetrievalResult(
+            context=packed.context,
+            chunk_ids=packed.chunk_ids,
+            scores=packed.scores,
+            timings=timings,
+            chat_history=packed.chat_history
+        )
 
-        for idx, score in bm25l_results:
-            doc_content = self.retrieval_system.docs[idx].page_content
-            heapq.heappush(combined_results, (-0.3 * score, doc_content))
+    def fuse_results(self, vector_results: List[Tuple[Document, float]], bm25l_results: List[Tuple[int, float]],
+                     tfidf_query=None, view: Optional[RoleRetrievalView] = None) -> List[Tuple[str, float]]:
+        """
+        Fusiona las ramas por chunk_id (FUSION_METHOD). Un fragmento devuelto
+        por varias ramas suma sus aportaciones, y TF-IDF solo se consulta para
+        los candidatos de las otras dos ramas.
+        """
+        view = view or self.retrieval_system
+        docs = view.docs
+        rankings = {
+            "vector": [(doc.metadata["chunk_id"], score) for doc, score in vector_results],
+            "bm25l": [(docs[idx].metadata["chunk_id"], score) for idx, score in bm25l_results],
+        }
+        if tfidf_query is not None:
+            candidates = list({chunk_id: None for ranking in rankings.values() for chunk_id, _ in ranking})
+            rankings["tfidf"] = self.tfidf_rescore(tfidf_query, candidates, view)
+        return fuse(rankings, method=FUSION_METHOD, weights=FUSION_WEIGHTS, rrf_k=RRF_K)
 
-        tfidf_scores = self.retrieval_system.tfidf_vectorizer.transform([combined_query]).toarray()[0]
-        for idx, doc in enumerate(self.retrieval_system.docs):
-            doc_content = doc.page_content
-            if any(doc_content == content for _, content in combined_results):
-                heapq.heappush(combined_results, (-0.1 * tfidf_scores[idx], doc_content))
+    async def _run_branch(self, name: str, coroutine, default, timings: Dict[str, float]):
+        """
+        Espera una rama de recuperación con su timeout (RETRIEVAL_TIMEOUTS).
+        Si vence, la rama devuelve `default` y el resto continúa; el hilo del
+        executor termina su trabajo en segundo plano.
+        """
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(coroutine, timeout=RETRIEVAL_TIMEOUTS[name])
+        except asyncio.TimeoutError:
+            logging.warning("Rama %s superó su timeout de %.2fs; se descarta", name, RETRIEVAL_TIMEOUTS[name])
+            return default
+        finally:
+            timings[name] = time.perf_counter() - started
+            self.logger.info("Rama %s: %.1f ms", name, timings[name] * 1000)
 
-        top_results = heapq.nsmallest(10, combined_results)
-        docs_to_rerank = [doc for _, doc in top_results]
-        original_scores = [-score for score, _ in top_results]
-        reranked_docs = self.rerank_results(docs_to_rerank, combined_query, original_scores)
-        return "\n".join(reranked_docs[:5])
+    async def get_relevant_context(self, query: str, userId: str) -> str:
+        return (await self.retrieve(query, userId)).context
 
-    async def handle_query(self, query: str, userId: str):
+    async def handle_query(self, query: str, userId: str) -> QueryResult:
         if query.lower() == 'salir':
-            return False
-
-        # Inicializar la sesión si no existe
-        if userId not in self.sessions:
-            self.sessions[userId] = []
-        session_messages = self.sessions[userId]
+            return QueryResult(answer="", context="")
 
-        session_messages.append({"role": "user", "content": query})
+        session = self.get_session(userId)
+        cacheable = self.is_cacheable(session)
+        session.add_message("user", query)
         try:
+            stage = time.perf_counter()
+            cached, embedding, version = await self.cached_answer(query) if cacheable else (None, None, None)
+            if cached is not None:
+                self.record_turn(session, query, cached.answer)
+                return replace(cached, timings={"cache": time.perf_counter() - stage})
+
             self.logger.info("\nAnalizando documentos...")
-            # Awaits get_relevant_context instead of using asyncio.run
-            context = await self.get_relevant_context(query, userId)
-            formatted_prompt = self.prompt.format(
-                context=context,
-                question=query,
-                chat_history=self.memory.load_memory_variables({})["chat_history"]
-            )
+            # La recuperación se ejecuta una sola vez; el resultado incluye el contexto
+            retrieval = await self.retrieve(query, userId, session, embedding)
+            context = retrieval.context
+            inputs = {"context": context, "question": query, "chat_history": retrieval.chat_history}
             self.logger.info("\nPrompt enviado al modelo:")
-            self.logger.info(formatted_prompt)
-            response = self.chain.invoke({"context": context, "question": query})
-            self.memory.save_context({"question": query}, {"output": response})
+            self.logger.info(self.prompt.format(**inputs))
+            stage = time.perf_counter()
+            async with get_llm_semaphore():
+                response = await self.chain.ainvoke(inputs)
+            retrieval.timings["generation"] = time.perf_counter() - stage
+            self.record_turn(session, query, response)
             self.logger.info("\nRespuesta: %s", response)
-            session_messages.append({"role": "assistant", "content": response})
 
         except Exception as e:
             logging.error("Error procesando la consulta: %s", str(e))
             fallback = self.fallback_keyword_search(query)
             self.logger.info(f"\nError: Lo siento, pero encontré un error al procesar tu consulta. Basado en búsqueda por palabras clave: {fallback}")
-            return fallback
-        return response
-    async def vector_search(self, query: str) -> List[Document]:
+            return QueryResult(answer=fallback, context=fallback)
+        finally:
+            self.save_session(userId, session)
+        result = QueryResult(
+            answer=response,
+            context=context,
+            chunk_ids=retrieval.chunk_ids,
+            scores=retrieval.scores,
+            timings=retrieval.timings
+        )
+        if cacheable:
+            self.answer_cache.put(self.retrieval_system.role, version, query, result, embedding)
+        return result
+
+    async def stream_query(self, query: str, userId: str) -> AsyncIterator[dict]:
+        """
+        Versión en streaming de handle_query: emite primero el contexto
+        recuperado y después cada token a medida que el modelo lo genera.
+        Eventos: {"type": "context"|"token"|"done"|"error", ...}.
+        """
+        session = self.get_session(userId)
+        cacheable = self.is_cacheable(session)
+        session.add_message("user", query)
+        try:
+            stage = time.perf_counter()
+            cached, embedding, version = await self.cached_answer(query) if cacheable else (None, None, None)
+            if cached is not None:
+                yield {
+                    "type": "context",
+                    "context": cached.context,
+                    "chunk_ids": cached.chunk_ids,
+                    "scores": cached.scores
+                }
+                yield {"type": "token", "token": cached.answer}
+                self.record_turn(session, query, cached.answer)
+                yield {"type": "done", "answer": cached.answer, "timings": {"cache": time.perf_counter() - stage}}
+                return
+
+            self.logger.info("\nAnalizando documentos...")
+            retrieval = await self.retrieve(query, userId, session, embedding)
+            context = retrieval.context
+            yield {
+                "type": "context",
+                "context": context,
+                "chunk_ids": retrieval.chunk_ids,
+                "scores": retrieval.scores
+            }
+
+            stage = time.perf_counter()
+            tokens = []
+            async with get_llm_semaphore():
+                inputs = {"context": context, "question": query, "chat_history": retrieval.chat_history}
+                async for token in self.chain.astream(inputs):
+                    tokens.append(token)
+                    yield {"type": "token", "token": token}
+            response = "".join(tokens)
+            retrieval.timings["generation"] = time.perf_counter() - stage
+            self.record_turn(session, query, response)
+            self.logger.info("\nRespuesta: %s", response)
+            if cacheable:
+                self.answer_cache.put(self.retrieval_system.role, version, query, QueryResult(
+                    answer=response,
+                    context=context,
+                    chunk_ids=retrieval.chunk_ids,
+                    scores=retrieval.scores,
+                    timings=retrieval.timings
+                ), embedding)
+            yield {"type": "done", "answer": response, "timings": retrieval.timings}
+
+        except Exception as e:
+            logging.error("Error procesando la consulta: %s", str(e))
+            fallback = self.fallback_keyword_search(query)
+            yield {"type": "error", "detail": str(e), "answer": fallback}
+        finally:
+            self.save_session(userId, session)
+
+    async def vector_search(self, query: str, view: Optional[RoleRetrievalView] = None,
+                            embedding: Optional[List[float]] = None) -> List[Tuple[Document, float]]:
         try:
-            return self.retrieval_system.vectorstore.similarity_search(query, k=10)
+            return await get_executor("vector").run(
+                (view or self.retrieval_system).vector_search, query, k=10, embedding=embedding
+            )
         except Exception as e:
             logging.error(f"Búsqueda vectorial fallida: {str(e)}")
             return []
 
-    async def bm25l_search(self, query: str) -> List[Tuple[int, float]]:
+    async def bm25l_search(self, query: str, view: Optional[RoleRetrievalView] = None) -> List[Tuple[int, float]]:
         try:
-            return self.retrieval_system.bm25l_retriever.retrieve(query, top_k=10)
+            return await get_executor("bm25l").run((view or self.retrieval_system).bm25l_search, query, top_k=10)
         except Exception as e:
             logging.error(f"Búsqueda BM25L fallida: {str(e)}")
             return []
 
-    def rerank_results(self, docs: List[str], query: str, original_scores: List[float]) -> List[str]:
-        pairs = [[query, doc] for doc in docs]
-        scores = self.cross_encoder.predict(pairs)
+    async def tfidf_search(self, query: str, view: Optional[RoleRetrievalView] = None):
+        try:
+            return await get_executor("tfidf").run(self.tfidf_vector, query, view)
+        except Exception as e:
+            logging.error(f"Búsqueda TF-IDF fallida: {str(e)}")
+            return None
+
+    def tfidf_vector(self, query: str, view: Optional[RoleRetrievalView] = None):
+        """Vector TF-IDF disperso de la consulta (sin convertir a denso)."""
+        view = view or self.retrieval_system
+        tfidf_index = view.tfidf_index
+        # La matriz del corpus se reconstruye aquí (en el executor) tras un
+        # cambio del índice, no durante la fusión en el bucle de eventos.
+        tfidf_index.document_matrix()
+        return tfidf_index.transform([view.encode_query(query)])
+
+    def tfidf_rescore(self, tfidf_query, chunk_ids: List[str],
+                      view: Optional[RoleRetrievalView] = None) -> List[Tuple[str, float]]:
+        """Similitud coseno TF-IDF de la consulta con cada fragmento candidato."""
+        view = view or self.retrieval_system
+        positions = [view.position(chunk_id) for chunk_id in chunk_ids]
+        scores = view.tfidf_index.similarity(tfidf_query, positions)
+        return list(zip(chunk_ids, scores.tolist()))
+
+    async def rerank_results(self, docs: List[Document], query: str,
+                             original_scores: List[float]) -> List[Tuple[int, float]]:
+        """
+        Devuelve (posición en `docs`, puntuación combinada) de mayor a menor
+        puntuación. Si la fusión ya es concluyente se conserva su orden.
+        """
+        if not docs:
+            return []
+        if self.reranker.is_decisive(original_scores):
+            self.logger.info("Margen de la fusión concluyente; se omite el reranking")
+            return list(enumerate(original_scores))
+        scores = await self.reranker.score(
+            query, [(doc.metadata["chunk_id"], doc.page_content) for doc in docs]
+        )
         combined_scores = [0.7 * new_score + 0.3 * original_score for new_score, original_score in zip(scores, original_scores)]
-        return [doc for _, doc in sorted(zip(combined_scores, docs), reverse=True)]
+        return sorted(enumerate(combined_scores), key=lambda item: item[1], reverse=True)
 
     def fallback_keyword_search(self, query: str) -> str:
-        keywords = query.lower().split()
-        relevant_docs = []
-        for doc in self.retrieval_system.docs:
-            if any(keyword in doc.page_content.lower() for keyword in keywords):
-                relevant_docs.append(doc.page_content)
+        # Índice invertido de BM25L: funciona sin el modelo de embeddings ni el índice vectorial
+        relevant_docs = self.retrieval_system.keyword_search(query, top_k=3)
         if not relevant_docs:
             return "No pude encontrar información relevante. ¿Puedes reformular tu pregunta?"
-        return "\n".join(relevant_docs[:3])
+        return "\n".join(doc.page_content for doc in relevant_docs)
 
     def save_feedback(self, query: str, answer: str, feedback: int):
         feedback_data = {
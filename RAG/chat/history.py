@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from config.settings import HISTORY_TOKEN_BUDGET
+from utils.tokens import get_token_counter
+
+
+Turn = Tuple[str, str]
+
+SUMMARY_PROMPT = """Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary. Write the summary in Spanish and keep names, figures and dates.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+@dataclass
+class ConversationHistory:
+    """
+    Historial de una sesión: los turnos recientes (pregunta, respuesta) se
+    conservan literales hasta `max_tokens`; los más antiguos se condensan en
+    `summary` fuera del camino de la petición (ver ChatHandler).
+    """
+    turns: List[Turn] = field(default_factory=list)
+    summary: str = ""
+    max_tokens: int = HISTORY_TOKEN_BUDGET
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append((question, answer))
+
+    def _turn_tokens(self, turn: Turn) -> int:
+        counter = get_token_counter()
+        return counter.count(turn[0]) + counter.count(turn[1])
+
+    def overflow(self) -> List[Turn]:
+        """
+        Turnos más antiguos que exceden el presupuesto y hay que resumir. El
+        último turno siempre se conserva literal.
+        """
+        total = sum(self._turn_tokens(turn) for turn in self.turns)
+        count = 0
+        while total > self.max_tokens and count < len(self.turns) - 1:
+            total -= self._turn_tokens(self.turns[count])
+            count += 1
+        return self.turns[:count]
+
+    def summary_prompt(self, turns: List[Turn]) -> str:
+        lines = "\n".join(f"Human: {question}\nAI: {answer}" for question, answer in turns)
+        return SUMMARY_PROMPT.format(summary=self.summary or "(vacío)", lines=lines)
+
+    def apply_summary(self, summary: str, turns: List[Turn]) -> bool:
+        """
+        Sustituye `turns` (que deben seguir siendo los primeros) por el nuevo
+        resumen. Devuelve False si el historial cambió entretanto.
+        """
+        if [tuple(turn) for turn in self.turns[:len(turns)]] != [tuple(turn) for turn in turns]:
+            return False
+        self.turns = self.turns[len(turns):]
+        self.summary = summary.strip()
+        return True
+
+    def render(self) -> str:
+        parts = [f"Resumen: {self.summary}"] if self.summary else []
+        for question, answer in self.turns:
+            parts.append(f"Usuario: {question}\nAsistente: {answer}")
+        return "\n".join(parts)
+
+    def size_bytes(self) -> int:
+        return len(self.summary.encode("utf-8")) + sum(
+            len(question.encode("utf-8")) + len(answer.encode("utf-8")) for question, answer in self.turns
+        )
+
+    def to_dict(self) -> dict:
+        return {"summary": self.summary, "turns": [list(turn) for turn in self.turns]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConversationHistory":
+        return cls(turns=[tuple(turn) for turn in data.get("turns", [])], summary=data.get("summary", ""))
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from cachetools import LRUCache
+
+from chat.executors import get_executor
+from models.registry import get_cross_encoder
+from config.settings import RERANK_CACHE_SIZE, RERANK_MAX_BATCH, RERANK_MAX_WAIT_MS, RERANK_SKIP_MARGIN
+
+
+class RerankerService:
+    """
+    Puntúa pares (consulta, fragmento) con un cross-encoder compartido.
+
+    Los pares de peticiones concurrentes se agrupan en un mismo lote (hasta
+    `max_batch` pares o `max_wait_ms` de espera) para amortizar cada llamada
+    a `predict`, y las puntuaciones se guardan en una caché LRU por
+    (hash de la consulta, chunk_id).
+    """
+    def __init__(self, cross_encoder, max_batch: int = RERANK_MAX_BATCH, max_wait_ms: float = RERANK_MAX_WAIT_MS,
+                 cache_size: int = RERANK_CACHE_SIZE, skip_margin: float = RERANK_SKIP_MARGIN):
+        self.cross_encoder = cross_encoder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.skip_margin = skip_margin
+        self.cache = LRUCache(maxsize=cache_size)
+        self.hits = 0
+        self.misses = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop = None
+        self._worker = None
+        # Lotes en curso: el bucle de eventos solo guarda referencias débiles
+        self._batches = set()
+
+    @staticmethod
+    def query_hash(query: str) -> str:
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    def is_decisive(self, scores: Sequence[float]) -> bool:
+        """
+        Indica si la primera etapa ya separa claramente al mejor candidato
+        (margen sobre el segundo >= skip_margin), en cuyo caso no se reordena.
+        """
+        if self.skip_margin <= 0 or len(scores) < 2:
+            return False
+        return scores[0] - scores[1] >= self.skip_margin
+
+    def _ensure_worker(self):
+        # La cola pertenece a un bucle de eventos concreto
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._collect())
+
+    async def score(self, query: str, candidates: Sequence[Tuple[str, str]]) -> List[float]:
+        """
+        Puntuaciones del cross-encoder para los candidatos (chunk_id, texto),
+        en el mismo orden.
+        """
+        self._ensure_worker()
+        qhash = self.query_hash(query)
+        scores: List[Optional[float]] = [None] * len(candidates)
+        pending = []
+        for i, (chunk_id, text) in enumerate(candidates):
+            key = (qhash, chunk_id)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.hits += 1
+                scores[i] = cached
+                continue
+            self.misses += 1
+            future = self._loop.create_future()
+            self._queue.put_nowait((query, text, key, future))
+            pending.append((i, future))
+        for i, future in pending:
+            scores[i] = await future
+        return scores
+
+    async def _collect(self):
+        """Forma lotes con los pares en cola y los lanza sin esperar al anterior."""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = self._loop.create_task(self._predict(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _predict(self, batch: list):
+        try:
+            scores = await get_executor("rerank").run(
+                self.cross_encoder.predict, [[query, text] for query, text, _, _ in batch]
+            )
+        except Exception as e:
+            logging.error(f"Reranking fallido: {str(e)}")
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, key, future), score in zip(batch, scores):
+            self.cache[key] = float(score)
+            if not future.done():
+                future.set_result(float(score))
+
+
+_rerankers: Dict[str, RerankerService] = {}
+
+
+def get_reranker(model_name: str) -> RerankerService:
+    """
+    Devuelve el servicio de reranking (uno por proceso y modelo), de modo que
+    todos los manejadores comparten el cross-encoder, los lotes y la caché.
+    """
+    if model_name not in _rerankers:
+        _rerankers[model_name] = RerankerService(get_cross_encoder(model_name))
+        logging.info("Cross-encoder %s loaded", model_name)
+    return _rerankers[model_name]
@@ -0,0 +1,58 @@
+from dataclasses import dataclass, field
+from typing import List
+
+from chat.history import ConversationHistory
+
+
+# Mensajes recientes que se usan para ampliar la consulta de recuperación
+MAX_RECENT_MESSAGES = 10
+
+
+@dataclass
+class ChatSession:
+    """
+    Estado de conversación de un usuario: mensajes recientes e historial
+    con resumen. Los modelos (LLM, cross-encoder, embeddings) no forman
+    parte de la sesión; se comparten entre todas mediante models.registry.
+    """
+    user_id: str
+    history: ConversationHistory = field(default_factory=ConversationHistory)
+    messages: List[dict] = field(default_factory=list)
+
+    @classmethod
+    def create(cls, user_id: str) -> "ChatSession":
+        return cls(user_id=user_id)
+
+    def add_message(self, role: str, content: str):
+        self.messages.append({"role": role, "content": content})
+        del self.messages[:-MAX_RECENT_MESSAGES]
+
+    def has_history(self) -> bool:
+        """
+        Indica si hay mensajes o turnos anteriores: amplían la consulta de
+        recuperación y entran en el prompt, así que la respuesta ya no
+        depende solo de la pregunta.
+        """
+        return bool(self.messages or self.history.turns or self.history.summary)
+
+    def chat_history(self) -> str:
+        return self.history.render()
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "messages": self.messages,
+            "history": self.history.to_dict(),
+        }
+
+    def load_state(self, data: dict):
+        """Restaura el estado guardado con `to_dict`."""
+        self.messages = data.get("messages", [])[-MAX_RECENT_MESSAGES:]
+        history = data.get("history")
+        self.history = ConversationHistory.from_dict(history if isinstance(history, dict) else {})
+
+    def size_bytes(self) -> int:
+        """Tamaño aproximado del texto que guarda la sesión."""
+        return self.history.size_bytes() + sum(
+            len(message["content"].encode("utf-8")) for message in self.messages
+        )
@@ -0,0 +1,224 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from chat.session import ChatSession
+from config.settings import (
+    SESSION_DB_PATH, SESSION_MAX, SESSION_MEMORY_BUDGET_MB, SESSION_STORE, SESSION_SWEEP_SECONDS, SESSION_TTL_SECONDS
+)
+
+
+SessionFactory = Callable[[str], ChatSession]
+
+
+class SessionStore(ABC):
+    """
+    Almacén de sesiones de chat por clave (rol y userId). Las
+    implementaciones acotan cuántas sesiones se conservan y exponen métricas
+    de tamaño y expulsiones.
+    """
+    @abstractmethod
+    def get(self, key: str, factory: SessionFactory) -> Optional[ChatSession]:
+        """Sesión existente o None; `factory` crea la sesión vacía en la que se carga el estado."""
+
+    @abstractmethod
+    def put(self, key: str, session: ChatSession):
+        """Guarda la sesión tras modificarla."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Borra la sesión si existe."""
+
+    @abstractmethod
+    def metrics(self) -> dict:
+        """Número de sesiones, tamaño y expulsiones."""
+
+    def get_or_create(self, key: str, factory: SessionFactory) -> ChatSession:
+        session = self.get(key, factory)
+        if session is None:
+            session = factory(key)
+            self.put(key, session)
+        return session
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sesiones en memoria del proceso con expulsión LRU por número de
+    sesiones, por inactividad (TTL) y por un presupuesto de memoria.
+    """
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl_seconds: float = SESSION_TTL_SECONDS,
+                 memory_budget_bytes: int = int(SESSION_MEMORY_BUDGET_MB * 1024 * 1024)):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        # key -> (sesión, último acceso, tamaño); el primero es el menos reciente
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = {"lru": 0, "ttl": 0, "memory": 0}
+        self._lock = threading.Lock()
+
+    def _evict(self, key: str, reason: str):
+        _, _, size = self._sessions.pop(key)
+        self._bytes -= size
+        self.evictions[reason] += 1
+
+    def _expire(self, now: float):
+        while self._sessions:
+            key, (_, last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            self._evict(key, "ttl")
+
+    def get(self, key: str, factory: SessionFactory) -> Optional[ChatSession]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            self._sessions[key] = (entry[0], now, entry[2])
+            self._sessions.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, session: ChatSession):
+        now = time.monotonic()
+        size = session.size_bytes()
+        with self._lock:
+            if key in self._sessions:
+                self._bytes -= self._sessions.pop(key)[2]
+            self._sessions[key] = (session, now, size)
+            self._bytes += size
+            self._expire(now)
+            while len(self._sessions) > self.max_sessions:
+                self._evict(next(iter(self._sessions)), "lru")
+            while self._bytes > self.memory_budget_bytes and len(self._sessions) > 1:
+                self._evict(next(iter(self._sessions)), "memory")
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._sessions:
+                self._bytes -= self._sessions.pop(key)[2]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "evictions": dict(self.evictions),
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones guardadas en SQLite: sobreviven a reinicios y varios workers
+    de uvicorn pueden compartir el mismo fichero. Las sesiones inactivas
+    más de `ttl_seconds` se borran y, por encima de `max_sessions`, se
+    borran las de acceso más antiguo.
+
+    El barrido se hace como mucho una vez cada `sweep_seconds` y no en cada
+    escritura: entre barridos `get` ya ignora las sesiones caducadas, y el
+    número de sesiones puede superar `max_sessions` temporalmente.
+    """
+    def __init__(self, path: str = SESSION_DB_PATH, max_sessions: int = SESSION_MAX,
+                 ttl_seconds: float = SESSION_TTL_SECONDS, sweep_seconds: float = SESSION_SWEEP_SECONDS):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self._last_sweep = float("-inf")
+        self.evictions = {"lru": 0, "ttl": 0}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, data TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        self._connection.commit()
+
+    def _expire(self, now: float, force: bool = False):
+        if not force and now - self._last_sweep < self.sweep_seconds:
+            return
+        self._last_sweep = now
+        # El índice sessions_last_access evita recorrer toda la tabla
+        cursor = self._connection.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl_seconds,))
+        self.evictions["ttl"] += cursor.rowcount
+        cursor = self._connection.execute(
+            "DELETE FROM sessions WHERE key IN ("
+            "SELECT key FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+        self.evictions["lru"] += cursor.rowcount
+
+    def get(self, key: str, factory: SessionFactory) -> Optional[ChatSession]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM sessions WHERE key = ? AND last_access >= ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE sessions SET last_access = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+        session = factory(key)
+        session.load_state(json.loads(row[0]))
+        return session
+
+    def put(self, key: str, session: ChatSession):
+        now = time.time()
+        data = json.dumps(session.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (key, data, last_access) VALUES (?, ?, ?)", (key, data, now)
+            )
+            self._expire(now)
+            self._connection.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._expire(time.time(), force=True)
+            self._connection.commit()
+            count, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "bytes": size,
+            "evictions": dict(self.evictions),
+        }
+
+
+SESSION_STORES: Dict[str, Callable[[], SessionStore]] = {
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+_session_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    """
+    Devuelve el almacén de sesiones del proceso (SESSION_STORE), compartido
+    por los manejadores de todos los roles.
+    """
+    global _session_store
+    if _session_store is None:
+        if SESSION_STORE not in SESSION_STORES:
+            raise ValueError(f"Unknown session store: {SESSION_STORE}")
+        _session_store = SESSION_STORES[SESSION_STORE]()
+        logging.info("Session store: %s", SESSION_STORE)
+    return _session_store
@@ -0,0 +1,144 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "postings" (índice invertido) o "sparse" (matriz CSR)
+BM25_BACKEND = os.getenv("BM25_BACKEND", "postings")
+
+# Análisis léxico de BM25L, TF-IDF y la búsqueda por palabras clave:
+# eliminar palabras vacías y aplicar stemming en español (requiere nltk)
+ANALYZER_STOPWORDS = os.getenv("ANALYZER_STOPWORDS", "true").lower() in ("1", "true", "yes")
+ANALYZER_STEMMING = os.getenv("ANALYZER_STEMMING", "false").lower() in ("1", "true", "yes")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Directorio del índice compartido por todos los roles (Chroma + BM25L + TF-IDF)
+INDEX_DIRECTORY = os.getenv("INDEX_DIRECTORY", "chroma_db")
+# Único directorio desde el que POST/DELETE /documents pueden ingerir PDFs
+DOCUMENTS_DIRECTORY = os.getenv("DOCUMENTS_DIRECTORY", ".")
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
+
+# Procesos para extraer y fragmentar PDFs en paralelo (1 = secuencial)
+PDF_LOADER_WORKERS = int(os.getenv("PDF_LOADER_WORKERS", 1))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+
+# Llamadas simultáneas permitidas por etapa del pipeline de consulta
+STAGE_CONCURRENCY = {
+    "vector": int(os.getenv("VECTOR_CONCURRENCY", 4)),
+    "bm25l": int(os.getenv("BM25L_CONCURRENCY", 4)),
+    "tfidf": int(os.getenv("TFIDF_CONCURRENCY", 4)),
+    "rerank": int(os.getenv("RERANK_CONCURRENCY", 2)),
+    "llm": int(os.getenv("LLM_CONCURRENCY", 4)),
+}
+
+# Tiempo máximo (segundos) de cada rama de recuperación antes de descartarla
+RETRIEVAL_TIMEOUTS = {
+    "vector": float(os.getenv("VECTOR_TIMEOUT", 5.0)),
+    "bm25l": float(os.getenv("BM25L_TIMEOUT", 2.0)),
+    "tfidf": float(os.getenv("TFIDF_TIMEOUT", 2.0)),
+}
+
+# Fusión de las ramas de recuperación: "weighted" (puntuaciones normalizadas) o "rrf"
+FUSION_METHOD = os.getenv("FUSION_METHOD", "weighted")
+FUSION_WEIGHTS = {
+    "vector": float(os.getenv("VECTOR_WEIGHT", 0.6)),
+    "bm25l": float(os.getenv("BM25L_WEIGHT", 0.3)),
+    "tfidf": float(os.getenv("TFIDF_WEIGHT", 0.1)),
+}
+RRF_K = int(os.getenv("RRF_K", 60))
+
+# Reranking: pares (consulta, fragmento) por lote del cross-encoder, espera
+# máxima para completar un lote, tamaño de la caché de puntuaciones y margen
+# entre los dos primeros candidatos a partir del cual no se reordena (0 = nunca)
+RERANK_MAX_BATCH = int(os.getenv("RERANK_MAX_BATCH", 32))
+RERANK_MAX_WAIT_MS = float(os.getenv("RERANK_MAX_WAIT_MS", 5))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 10000))
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", 0.0))
+
+# Backend de inferencia del modelo de embeddings y del cross-encoder: "torch" u "onnx"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")
+# Modelos exportados a ONNX (se exportan la primera vez que se usan)
+ONNX_MODEL_DIRECTORY = os.getenv("ONNX_MODEL_DIRECTORY", "onnx_models")
+# Usar la versión cuantizada a int8 (cuantización dinámica de pesos)
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "false").lower() in ("1", "true", "yes")
+# Hilos por sesión de onnxruntime (0 = los que decida onnxruntime)
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))
+# Ingesta: fragmentos por lote de embeddings y lotes embebidos a la vez
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 1))
+
+# Sesiones de chat: "memory" (LRU en proceso) o "sqlite" (persisten entre
+# reinicios y se comparten entre workers de uvicorn)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_MAX = int(os.getenv("SESSION_MAX", 1000))
+# Segundos de inactividad tras los que se descarta una sesión
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 3600))
+# Memoria máxima aproximada de las sesiones en proceso
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", 64))
+# Segundos mínimos entre dos barridos de sesiones caducadas en SQLite
+SESSION_SWEEP_SECONDS = float(os.getenv("SESSION_SWEEP_SECONDS", 60))
+
+# Caché de respuestas: exacta por consulta normalizada, rol y versión del
+# índice, y opcionalmente semántica (similitud del embedding de la consulta)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 500))
+# Embeddings de consultas recientes que no se vuelven a calcular
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 2048))
+
+# Historial de conversación: tokens de turnos recientes que se conservan
+# literales; los anteriores se resumen en segundo plano
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 512))
+
+# Ventana de contexto que se pide a Ollama (num_ctx) y tokens reservados
+# para la respuesta (num_predict). Ollama descarta sin avisar el principio
+# de un prompt que no cabe en num_ctx
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", 4096))
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", 1024))
+
+# Presupuesto de tokens del prompt (instrucciones, contexto, historial y
+# pregunta); por defecto lo que deja libre la respuesta en num_ctx.
+# CONTEXT_TOKENIZER es un tokenizador de Hugging Face afín al modelo de
+# chat; vacío = estimación por caracteres
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", OLLAMA_NUM_CTX - LLM_MAX_OUTPUT_TOKENS))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "")
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", 5))
+# Fracción máxima del presupuesto restante que puede ocupar el historial
+HISTORY_PROMPT_SHARE = float(os.getenv("HISTORY_PROMPT_SHARE", 0.25))
+
+# Servidor de Ollama y tiempo que mantiene el modelo cargado tras cada
+# petición (duración como "30m", segundos o -1 para no descargarlo nunca)
+LLAMA_BASE_URL = os.getenv("LLAMA_BASE_URL", "http://localhost:11434")
+_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip("-").isdigit() else _keep_alive
+# Conexiones HTTP reutilizables hacia Ollama (compartidas por todo el proceso)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", 16))
+OLLAMA_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_TIMEOUT_SECONDS", 300))
+# Generación corta al arrancar para cargar el modelo antes de la primera consulta
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() in ("1", "true", "yes")
+# Si Ollama no responde, el warm-up se reintenta con espera exponencial
+# (segundos iniciales y máximos entre intentos) hasta que el modelo carga
+LLM_WARMUP_RETRY_SECONDS = float(os.getenv("LLM_WARMUP_RETRY_SECONDS", 2))
+LLM_WARMUP_MAX_RETRY_SECONDS = float(os.getenv("LLM_WARMUP_MAX_RETRY_SECONDS", 60))
+
+# Índice vectorial: "chroma", "ivf" (aproximado, en proceso y cuantizado) o
+# "exact" (fuerza bruta sobre un memmap; adecuado hasta ~100k fragmentos)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Tipo del memmap de embeddings del backend "exact": "float32" o "float16"
+VECTOR_MEMMAP_DTYPE = os.getenv("VECTOR_MEMMAP_DTYPE", "float32")
+# Listas de k-means del IVF (0 = raíz cuadrada del número de fragmentos) y
+# listas visitadas por consulta: más nprobe, más recall y más latencia
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+# Vectores en memoria: "int8", "fp16" o "none" (float32)
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8")
+# Candidatos aproximados que se vuelven a puntuar con los vectores exactos
+VECTOR_RESCORE_CANDIDATES = int(os.getenv("VECTOR_RESCORE_CANDIDATES", 50))
@@ -0,0 +1,51 @@
+"""
+Ingesta incremental de documentos en el índice compartido.
+
+    python ingest.py add Salarios.pdf --roles admin contabilidad
+    python ingest.py remove Salarios.pdf
+
+Actualiza el índice en disco (Chroma, BM25L y TF-IDF) sin reconstruirlo. Un
+servidor en marcha no ve los cambios hasta reiniciarse; para actualizarlo en
+caliente usa los endpoints POST/DELETE /documents de api.py.
+"""
+import argparse
+import logging
+
+from config.settings import CHUNK_OVERLAP, CHUNK_SIZE, EMBEDDING_MODEL, INDEX_DIRECTORY
+from models.backends import embedding_model_id
+from retrieval.index_store import IndexStore
+from retrieval.ingestion import IngestionService, open_retrieval_system, resolve_role_pdf_mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add, replace or remove one PDF in the RAG index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Add or replace a PDF")
+    add_parser.add_argument("path")
+    add_parser.add_argument("--roles", nargs="*", default=[], help="Roles allowed to read the PDF")
+    remove_parser = subparsers.add_parser("remove", help="Remove a PDF")
+    remove_parser.add_argument("path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    role_pdf_mapping = resolve_role_pdf_mapping(IndexStore(INDEX_DIRECTORY).load_ingestion())
+    pdf_files = sorted({pdf for pdfs in role_pdf_mapping.values() for pdf in pdfs})
+    retrieval_system = open_retrieval_system(
+        pdf_files,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        embedding_model=embedding_model_id(EMBEDDING_MODEL)
+    )
+    if retrieval_system is None:
+        raise SystemExit("No index available: none of the configured PDFs could be loaded")
+
+    service = IngestionService(retrieval_system, role_pdf_mapping, CHUNK_SIZE, CHUNK_OVERLAP)
+    if args.command == "add":
+        stats = service.add_document(args.path, args.roles)
+    else:
+        stats = service.remove_document(args.path)
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,164 @@
-from typing import List
+from typing import Dict, Iterator, List, Optional
+from concurrent.futures import ProcessPoolExecutor
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from collections import Counter
+from pypdf import PdfReader
+import hashlib
 import logging
+import multiprocessing
 import os
+import time
+
+from config.settings import PDF_LOADER_WORKERS, PDF_PAGES_PER_TASK
+
+
+def assign_chunk_ids(docs: List[Document], source: str):
+    """
+    Etiqueta cada fragmento con su PDF de origen y un id estable derivado de
+    (origen, página, contenido). Un fragmento que no cambia entre dos
+    versiones del PDF conserva su id, lo que permite actualizar los índices
+    de forma incremental.
+    """
+    seen = Counter()
+    for doc in docs:
+        page = doc.metadata.get("page", 0)
+        key = (page, doc.page_content)
+        occurrence = seen[key]
+        seen[key] += 1
+        digest = hashlib.sha1(
+            f"{source}\x00{page}\x00{occurrence}\x00{doc.page_content}".encode("utf-8")
+        ).hexdigest()
+        doc.metadata["source"] = source
+        doc.metadata["chunk_id"] = digest[:20]
+
+
+def _load_page_range(pdf_file: str, start: int, end: int, chunk_size: int, chunk_overlap: int):
+    """
+    Extrae y fragmenta las páginas [start, end) de un PDF. Se ejecuta en un
+    proceso del pool; devuelve (fragmentos, segundos empleados).
+    """
+    started = time.perf_counter()
+    reader = PdfReader(pdf_file)
+    pages = [
+        Document(page_content=reader.pages[page].extract_text(), metadata={"source": pdf_file, "page": page})
+        for page in range(start, min(end, len(reader.pages)))
+    ]
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    docs = text_splitter.split_documents(pages)
+    # Los ids solo dependen de (origen, página, contenido): asignarlos por
+    # rango de páginas da el mismo resultado que sobre el PDF completo.
+    assign_chunk_ids(docs, pdf_file)
+    return docs, time.perf_counter() - started
 
 
 class PDFLoaderService:
     """
     Servicio para cargar y procesar archivos PDF.
+
+    Con max_workers > 1 las páginas de todos los PDFs se reparten en bloques
+    de `pages_per_task` entre un pool de procesos. Los fragmentos se
+    entregan en el orden de los PDFs y de sus páginas, igual que en modo
+    secuencial, a medida que termina cada bloque y todos los anteriores:
+    las posiciones en el índice no dependen de qué proceso acabó antes.
+
+    Los workers se arrancan con "spawn" y no con "fork": POST /documents
+    llega aquí desde un hilo del servidor, en un proceso con torch, httpx y
+    otros hilos activos, y un fork en ese estado puede bloquearse.
     """
-    def __init__(self, pdf_files: List[str], chunk_size: int, chunk_overlap: int):
+    def __init__(self, pdf_files: List[str], chunk_size: int, chunk_overlap: int,
+                 max_workers: Optional[int] = None, pages_per_task: Optional[int] = None):
         self.pdf_files = pdf_files
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers if max_workers is not None else PDF_LOADER_WORKERS
+        self.pages_per_task = pages_per_task if pages_per_task is not None else PDF_PAGES_PER_TASK
+        # Por PDF: páginas, fragmentos, segundos de reloj y segundos de CPU en los workers
+        self.file_timings: Dict[str, dict] = {}
 
     def load_pdfs(self) -> List[Document]:
-            all_docs = []
-            for pdf_file in self.pdf_files:
+        return list(self.iter_chunks())
+
+    def iter_chunks(self) -> Iterator[Document]:
+        """
+        Genera los fragmentos de todos los PDFs, en paralelo si max_workers > 1.
+        """
+        pdf_files = []
+        for pdf_file in self.pdf_files:
+            # Verify file exists and is in the allowed files list
+            if not os.path.exists(pdf_file):
+                logging.warning(f"File not found or not accessible: {pdf_file}")
+                continue
+            pdf_files.append(pdf_file)
+
+        if self.max_workers > 1:
+            yield from self._iter_chunks_parallel(pdf_files)
+        else:
+            for pdf_file in pdf_files:
+                yield from self._load_pdf(pdf_file)
+
+    def _load_pdf(self, pdf_file: str) -> List[Document]:
+        try:
+            started = time.perf_counter()
+            print(f"Loading PDF file: {pdf_file}")
+            loader = PyPDFLoader(pdf_file)
+            data = loader.load()
+            text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap
+            )
+            docs = text_splitter.split_documents(data)
+            # Tag every chunk with its PDF so role access can be filtered at query time
+            assign_chunk_ids(docs, pdf_file)
+            elapsed = time.perf_counter() - started
+            self.file_timings[pdf_file] = {
+                "pages": len(data), "chunks": len(docs), "seconds": elapsed, "worker_seconds": elapsed
+            }
+            logging.info("Successfully loaded %s (%d chunks in %.2fs)", pdf_file, len(docs), elapsed)
+            return docs
+        except Exception as e:
+            logging.error("Error loading %s: %s", pdf_file, str(e))
+            return []
+
+    def _iter_chunks_parallel(self, pdf_files: List[str]) -> Iterator[Document]:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = []
+            pending = {}
+            for pdf_file in pdf_files:
                 try:
-                    # Verify file exists and is in the allowed files list
-                    if not os.path.exists(pdf_file):
-                        logging.warning(f"File not found or not accessible: {pdf_file}")
-                        continue
-
-                    print(f"Loading PDF file: {pdf_file}")
-                    loader = PyPDFLoader(pdf_file)
-                    data = loader.load()
-                    text_splitter = RecursiveCharacterTextSplitter(
-                        chunk_size=self.chunk_size,
-                        chunk_overlap=self.chunk_overlap
+                    num_pages = len(PdfReader(pdf_file).pages)
+                except Exception as e:
+                    logging.error("Error loading %s: %s", pdf_file, str(e))
+                    continue
+                print(f"Loading PDF file: {pdf_file}")
+                self.file_timings[pdf_file] = {"pages": num_pages, "chunks": 0, "seconds": 0.0, "worker_seconds": 0.0}
+                pending[pdf_file] = 0
+                for start in range(0, num_pages, self.pages_per_task):
+                    future = executor.submit(
+                        _load_page_range, pdf_file, start, start + self.pages_per_task,
+                        self.chunk_size, self.chunk_overlap
                     )
-                    docs = text_splitter.split_documents(data)
-                    all_docs.extend(docs)
-                    logging.info("Successfully loaded %s", pdf_file)
+                    futures.append((future, pdf_file))
+                    pending[pdf_file] += 1
+
+            for future, pdf_file in futures:
+                timings = self.file_timings[pdf_file]
+                try:
+                    docs, worker_seconds = future.result()
                 except Exception as e:
                     logging.error("Error loading %s: %s", pdf_file, str(e))
-            return all_docs
+                    docs, worker_seconds = [], 0.0
+                timings["chunks"] += len(docs)
+                timings["worker_seconds"] += worker_seconds
+                pending[pdf_file] -= 1
+                if pending[pdf_file] == 0:
+                    timings["seconds"] = time.perf_counter() - started
+                    logging.info(
+                        "Successfully loaded %s (%d pages, %d chunks, %.2fs wall, %.2fs in workers)",
+                        pdf_file, timings["pages"], timings["chunks"], timings["seconds"], timings["worker_seconds"]
+                    )
+                yield from docs
@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import logging
+import threading
+import time
+
+from cachetools import LRUCache
+from langchain_core.embeddings import Embeddings
+
+from config.settings import (
+    EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE, EMBEDDING_THREADS, LLAMA_BASE_URL, LLM_MAX_OUTPUT_TOKENS, OLLAMA_KEEP_ALIVE,
+    OLLAMA_NUM_CTX, ONNX_MODEL_DIRECTORY, ONNX_QUANTIZE, ONNX_THREADS, QUERY_EMBEDDING_CACHE_SIZE, RERANKER_BACKEND
+)
+
+
+def embedding_model_id(model_name: str) -> str:
+    """
+    Identificador del modelo de embeddings que se guarda en el manifiesto del
+    índice: incluye el backend ONNX cuantizado porque sus vectores difieren
+    de los de PyTorch y obligan a reconstruir el índice.
+    """
+    if EMBEDDING_BACKEND == "onnx" and ONNX_QUANTIZE:
+        return f"{model_name}@onnx-int8"
+    return model_name
+
+
+def _onnx_directory(model_name: str, kind: str) -> str:
+    from models.onnx_backend import export_model, is_exported, model_directory
+
+    directory = model_directory(ONNX_MODEL_DIRECTORY, model_name)
+    if not is_exported(directory, quantize=ONNX_QUANTIZE):
+        logging.info("Exporting %s to ONNX", model_name)
+        export_model(model_name, kind, directory, quantize=ONNX_QUANTIZE)
+    return directory
+
+
+def create_embeddings(model_name: str):
+    """
+    Modelo de embeddings con el backend configurado (EMBEDDING_BACKEND).
+    """
+    if EMBEDDING_BACKEND == "onnx":
+        from models.onnx_backend import OnnxEmbeddings
+        return OnnxEmbeddings(_onnx_directory(model_name, "embedding"), quantize=ONNX_QUANTIZE, threads=ONNX_THREADS,
+                              batch_size=EMBEDDING_BATCH_SIZE)
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'batch_size': EMBEDDING_BATCH_SIZE}
+    )
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings de fragmentos para la ingesta: ordena los textos por longitud
+    para que cada lote agrupe textos parecidos (menos padding), los embebe
+    en lotes de `batch_size` repartidos entre `threads` hilos y registra
+    fragmentos por segundo y tiempo total. Las consultas pasan sin cambios.
+    """
+    def __init__(self, embeddings: Embeddings, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 threads: int = EMBEDDING_THREADS):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.threads = threads
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        started = time.perf_counter()
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        batch_texts = [[texts[idx] for idx in batch] for batch in batches]
+        if self.threads > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="embed") as pool:
+                results = list(pool.map(self._embed_batch, batch_texts))
+        else:
+            results = [self._embed_batch(batch) for batch in batch_texts]
+
+        embeddings = [None] * len(texts)
+        for batch, vectors in zip(batches, results):
+            for idx, vector in zip(batch, vectors):
+                embeddings[idx] = vector
+        elapsed = time.perf_counter() - started
+        logging.info(
+            "Embedded %d chunks in %.2fs (%.1f chunks/s, %d batches of %d, %d threads)",
+            len(texts), elapsed, len(texts) / elapsed if elapsed > 0 else 0.0,
+            len(batches), self.batch_size, max(self.threads, 1)
+        )
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envuelve un modelo de embeddings y guarda en una caché LRU los
+    embeddings de las consultas, que se repiten mucho (misma pregunta en la
+    búsqueda vectorial y en la caché semántica, o entre usuarios).
+    """
+    def __init__(self, embeddings: Embeddings, cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.cache = LRUCache(maxsize=cache_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            cached = self.cache.get(text)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+        embedding = self.embeddings.embed_query(text)
+        with self._lock:
+            self.cache[text] = embedding
+        return embedding
+
+
+def create_cross_encoder(model_name: str):
+    """
+    Cross-encoder con el backend configurado (RERANKER_BACKEND).
+    """
+    if RERANKER_BACKEND == "onnx":
+        from models.onnx_backend import OnnxCrossEncoder
+        return OnnxCrossEncoder(_onnx_directory(model_name, "cross-encoder"), quantize=ONNX_QUANTIZE,
+                                threads=ONNX_THREADS)
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name)
+
+
+def create_llm(model_name: str):
+    """
+    Cliente de Ollama para el modelo de chat. Sus clientes HTTP mantienen
+    un pool de conexiones con keep-alive (models.ollama_client.client_kwargs;
+    el registro crea un único cliente por modelo) y pide a Ollama que
+    mantenga el modelo cargado OLLAMA_KEEP_ALIVE entre peticiones, con una
+    ventana de OLLAMA_NUM_CTX tokens (PROMPT_TOKEN_BUDGET + la respuesta).
+    """
+    from langchain_ollama import OllamaLLM
+    from models.ollama_client import client_kwargs
+
+    return OllamaLLM(
+        model=model_name,
+        temperature=0.0,
+        base_url=LLAMA_BASE_URL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        num_predict=LLM_MAX_OUTPUT_TOKENS,
+        client_kwargs=client_kwargs()
+    )
@@ -0,0 +1,67 @@
+from typing import Optional, Tuple
+import logging
+import threading
+import time
+
+import httpx
+
+from config.settings import LLAMA_BASE_URL, OLLAMA_KEEP_ALIVE, OLLAMA_MAX_CONNECTIONS, OLLAMA_NUM_CTX, OLLAMA_TIMEOUT_SECONDS
+
+
+WARMUP_PROMPT = "Hola"
+
+_clients: Optional[Tuple] = None
+_lock = threading.Lock()
+
+
+def client_kwargs() -> dict:
+    """
+    Opciones de los clientes HTTP de Ollama: pool de OLLAMA_MAX_CONNECTIONS
+    conexiones con keep-alive y timeout de OLLAMA_TIMEOUT_SECONDS. Se pasan
+    también a OllamaLLM (`client_kwargs`), que crea sus propios clientes.
+    """
+    return {
+        "limits": httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_CONNECTIONS
+        ),
+        "timeout": httpx.Timeout(OLLAMA_TIMEOUT_SECONDS, connect=10.0),
+    }
+
+
+def get_ollama_clients():
+    """
+    Clientes síncrono y asíncrono de Ollama del proceso, para las llamadas
+    que no pasan por LangChain (precarga del modelo).
+    """
+    global _clients
+    with _lock:
+        if _clients is None:
+            from ollama import AsyncClient, Client
+
+            _clients = (
+                Client(host=LLAMA_BASE_URL, **client_kwargs()),
+                AsyncClient(host=LLAMA_BASE_URL, **client_kwargs()),
+            )
+            logging.info("Ollama client: %s", LLAMA_BASE_URL)
+        return _clients
+
+
+async def warm_up(model_name: str) -> float:
+    """
+    Genera un token con `model_name` para que Ollama cargue el modelo y lo
+    mantenga en memoria OLLAMA_KEEP_ALIVE. Devuelve los segundos que tardó.
+    Usa el mismo num_ctx que las consultas: con otro, Ollama recargaría el
+    modelo en la primera consulta.
+    """
+    _, async_client = get_ollama_clients()
+    started = time.perf_counter()
+    await async_client.generate(
+        model=model_name,
+        prompt=WARMUP_PROMPT,
+        options={"num_predict": 1, "num_ctx": OLLAMA_NUM_CTX},
+        keep_alive=OLLAMA_KEEP_ALIVE
+    )
+    elapsed = time.perf_counter() - started
+    logging.info("Model %s warmed up in %.2fs", model_name, elapsed)
+    return elapsed
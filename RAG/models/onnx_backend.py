@@ -0,0 +1,174 @@
+from typing import List, Sequence, Tuple
+import logging
+import os
+
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+
+from utils.helpers import load_json, save_json
+
+
+CONFIG_FILE = "backend_config.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+# Orden de los argumentos de forward() en los modelos tipo BERT
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def model_directory(base_directory: str, model_name: str) -> str:
+    return os.path.join(base_directory, model_name.replace("/", "__"))
+
+
+def is_exported(directory: str, quantize: bool = False) -> bool:
+    model_file = QUANTIZED_MODEL_FILE if quantize else MODEL_FILE
+    return all(os.path.exists(os.path.join(directory, f)) for f in (CONFIG_FILE, model_file))
+
+
+def export_model(model_name: str, kind: str, directory: str, quantize: bool = False) -> str:
+    """
+    Exporta un modelo de sentence-transformers ("embedding") o un
+    CrossEncoder ("cross-encoder") a ONNX junto con su tokenizador y, si se
+    pide, una versión cuantizada a int8. Necesita torch; la inferencia
+    posterior solo onnxruntime.
+    """
+    import torch
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+    from sentence_transformers.models import Normalize
+
+    os.makedirs(directory, exist_ok=True)
+    if kind == "embedding":
+        st_model = SentenceTransformer(model_name, device="cpu")
+        model, tokenizer = st_model[0].auto_model, st_model.tokenizer
+        config = {
+            "kind": kind,
+            "model_name": model_name,
+            "max_length": st_model.max_seq_length,
+            "pooling": st_model[1].get_pooling_mode_str(),
+            "normalize": any(isinstance(module, Normalize) for module in st_model),
+        }
+        output_name = "last_hidden_state"
+    elif kind == "cross-encoder":
+        cross_encoder = CrossEncoder(model_name, device="cpu")
+        model, tokenizer = cross_encoder.model, cross_encoder.tokenizer
+        config = {
+            "kind": kind,
+            "model_name": model_name,
+            "max_length": cross_encoder.max_length or tokenizer.model_max_length,
+            "activation": "sigmoid" if isinstance(cross_encoder.default_activation_function, torch.nn.Sigmoid)
+            else "identity",
+        }
+        output_name = "logits"
+    else:
+        raise ValueError(f"Unknown model kind: {kind}")
+
+    model.eval()
+    sample = tokenizer(["ejemplo", "otro ejemplo algo más largo"], padding=True, return_tensors="pt")
+    input_names = [name for name in INPUT_NAMES if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes[output_name] = {0: "batch", 1: "sequence"} if kind == "embedding" else {0: "batch"}
+    model_path = os.path.join(directory, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_path, os.path.join(directory, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(directory)
+    save_json(config, os.path.join(directory, CONFIG_FILE))
+    logging.info("Exported %s to %s", model_name, directory)
+    return directory
+
+
+class OnnxModel:
+    """
+    Sesión de onnxruntime con el tokenizador y la configuración de un
+    modelo exportado con `export_model`.
+    """
+    def __init__(self, directory: str, quantize: bool = False, threads: int = 0):
+        self.directory = directory
+        self.config = load_json(os.path.join(directory, CONFIG_FILE))
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(directory, QUANTIZED_MODEL_FILE if quantize else MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _run(self, *texts) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = self.tokenizer(
+            *texts,
+            padding=True,
+            truncation=True,
+            max_length=self.config["max_length"],
+            return_tensors="np"
+        )
+        feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        return self.session.run(None, feed)[0], encoded["attention_mask"]
+
+
+class OnnxEmbeddings(OnnxModel, Embeddings):
+    """
+    Embeddings de un modelo de sentence-transformers exportado a ONNX, con el
+    mismo pooling y normalización que el modelo original.
+    """
+    def __init__(self, directory: str, quantize: bool = False, threads: int = 0, batch_size: int = 32):
+        super().__init__(directory, quantize=quantize, threads=threads)
+        self.batch_size = batch_size
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            hidden, mask = self._run(list(texts[start:start + self.batch_size]))
+            if self.config.get("pooling") == "cls":
+                pooled = hidden[:, 0]
+            else:
+                weights = mask[..., None].astype(hidden.dtype)
+                pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            if self.config.get("normalize"):
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled)
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(batches)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+class OnnxCrossEncoder(OnnxModel):
+    """
+    Cross-encoder exportado a ONNX con la interfaz `predict` de
+    sentence_transformers.CrossEncoder.
+    """
+    def predict(self, pairs: Sequence[Sequence[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            logits, _ = self._run([pair[0] for pair in batch], [pair[1] for pair in batch])
+            if logits.shape[1] == 1:
+                logits = logits[:, 0]
+            if self.config.get("activation") == "sigmoid":
+                logits = 1 / (1 + np.exp(-logits))
+            scores.append(logits)
+        if not scores:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(scores)
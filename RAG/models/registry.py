@@ -0,0 +1,43 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+import threading
+
+from models.backends import BatchedEmbeddings, CachedEmbeddings, create_cross_encoder, create_embeddings, create_llm
+
+
+_models: Dict[Tuple[str, str], Any] = {}
+_lock = threading.Lock()
+
+
+def get_model(kind: str, name: str, factory: Callable[[str], Any]) -> Any:
+    """
+    Devuelve el modelo `name` de tipo `kind`, cargándolo con `factory` solo
+    la primera vez: todos los manejadores y sesiones del proceso comparten
+    la misma instancia.
+    """
+    key = (kind, name)
+    with _lock:
+        if key not in _models:
+            _models[key] = factory(name)
+            logging.info("Loaded %s model %s", kind, name)
+        return _models[key]
+
+
+def loaded_model(kind: str, name: str) -> Optional[Any]:
+    """El modelo `name` de tipo `kind` si ya está cargado, sin cargarlo."""
+    with _lock:
+        return _models.get((kind, name))
+
+
+def get_embeddings(model_name: str):
+    return get_model(
+        "embedding", model_name, lambda name: CachedEmbeddings(BatchedEmbeddings(create_embeddings(name)))
+    )
+
+
+def get_cross_encoder(model_name: str):
+    return get_model("cross-encoder", model_name, create_cross_encoder)
+
+
+def get_llm(model_name: str):
+    return get_model("llm", model_name, create_llm)
@@ -0,0 +1,114 @@
+"""
+Exportación a ONNX de los modelos de embeddings y reranking, y comprobación
+de que sus salidas coinciden con las de PyTorch.
+
+    python onnx_export.py export [--quantize]
+    python onnx_export.py check [--quantize] [--samples 64]
+
+Para usar los modelos exportados: EMBEDDING_BACKEND=onnx, RERANKER_BACKEND=onnx
+(y ONNX_QUANTIZE=true para la versión int8; ONNX_THREADS fija los hilos).
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+from scipy.stats import spearmanr
+
+from config.settings import CROSS_ENCODER_MODEL, EMBEDDING_MODEL, INDEX_DIRECTORY, ONNX_MODEL_DIRECTORY, ONNX_THREADS
+from models.onnx_backend import OnnxCrossEncoder, OnnxEmbeddings, export_model, model_directory
+from retrieval.index_store import IndexStore
+from utils.helpers import load_json
+
+
+SAMPLE_QUERIES = [
+    "¿Cuál es el salario de un ingeniero de software?",
+    "Tecnologías usadas en el proyecto",
+    "¿Qué es una red de funciones de base radial?",
+]
+SAMPLE_TEXTS = [
+    "El salario base de un ingeniero de software junior es de 3.000 euros.",
+    "El backend está desarrollado con FastAPI y usa Chroma como base vectorial.",
+    "Las redes RBF usan funciones gaussianas como activación en la capa oculta.",
+    "La política de vacaciones concede 23 días laborables al año.",
+]
+
+# Umbrales mínimos de la comprobación (fp32 / int8)
+THRESHOLDS = {
+    False: {"min_cosine": 0.9999, "min_spearman": 0.999},
+    True: {"min_cosine": 0.98, "min_spearman": 0.95},
+}
+
+
+def sample_texts(limit: int):
+    """Fragmentos del índice si existe; si no, textos de ejemplo."""
+    chunks = load_json(os.path.join(INDEX_DIRECTORY, IndexStore.CHUNKS_FILE)) \
+        if os.path.exists(os.path.join(INDEX_DIRECTORY, IndexStore.CHUNKS_FILE)) else []
+    texts = [chunk["page_content"] for chunk in chunks if chunk is not None][:limit]
+    return texts or SAMPLE_TEXTS
+
+
+def check_embeddings(texts, quantize: bool) -> dict:
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(EMBEDDING_MODEL, device="cpu").encode(texts, convert_to_numpy=True)
+    directory = model_directory(ONNX_MODEL_DIRECTORY, EMBEDDING_MODEL)
+    candidate = OnnxEmbeddings(directory, quantize=quantize, threads=ONNX_THREADS).encode(texts)
+    cosine = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    return {
+        "min_cosine": float(cosine.min()),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+    }
+
+
+def check_cross_encoder(texts, quantize: bool) -> dict:
+    from sentence_transformers import CrossEncoder
+
+    pairs = [[query, text] for query in SAMPLE_QUERIES for text in texts]
+    reference = np.asarray(CrossEncoder(CROSS_ENCODER_MODEL).predict(pairs))
+    directory = model_directory(ONNX_MODEL_DIRECTORY, CROSS_ENCODER_MODEL)
+    candidate = OnnxCrossEncoder(directory, quantize=quantize, threads=ONNX_THREADS).predict(pairs)
+    return {
+        "min_spearman": float(spearmanr(reference, candidate).correlation),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the RAG models to ONNX and check parity with PyTorch")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("export", "Export both models"), ("check", "Compare ONNX and PyTorch outputs")):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument("--quantize", action="store_true", help="Use the int8 quantized models")
+    subparsers.choices["check"].add_argument("--samples", type=int, default=64, help="Chunks to compare")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        export_model(EMBEDDING_MODEL, "embedding", model_directory(ONNX_MODEL_DIRECTORY, EMBEDDING_MODEL),
+                     quantize=args.quantize)
+        export_model(CROSS_ENCODER_MODEL, "cross-encoder", model_directory(ONNX_MODEL_DIRECTORY, CROSS_ENCODER_MODEL),
+                     quantize=args.quantize)
+        return
+
+    texts = sample_texts(args.samples)
+    thresholds = THRESHOLDS[args.quantize]
+    results = {
+        EMBEDDING_MODEL: check_embeddings(texts, args.quantize),
+        CROSS_ENCODER_MODEL: check_cross_encoder(texts[:16], args.quantize),
+    }
+    failed = False
+    for model_name, metrics in results.items():
+        print(model_name, metrics)
+        for metric, minimum in thresholds.items():
+            if metric in metrics and metrics[metric] < minimum:
+                print(f"  {metric} below {minimum}")
+                failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+from typing import Dict, List
+import re
+import unicodedata
+
+import numpy as np
+
+from config.settings import ANALYZER_STEMMING, ANALYZER_STOPWORDS
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Marcas diacríticas tras la descomposición NFKD (tildes, diéresis...). La
+# tilde de la ñ se conserva porque distingue palabras (año/ano)
+COMBINING_MARKS = re.compile(r"[\u0300-\u0302\u0304-\u036f]|(?<!n)\u0303")
+
+SPANISH_STOPWORDS = frozenset("""
+    a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el él ella
+    ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue ha han hasta hay he la
+    las le les lo los me mi mí mis mucho muchos muy más nada ni no nos o os otra otras otro otros para pero
+    poco por porque que qué quien quienes se ser si sí sin sobre son su sus también tanto te ti tu tú tus un
+    una uno unos y ya yo
+""".split())
+
+
+def analyzer_config() -> dict:
+    """Opciones del analizador configurado; forman parte del manifiesto del índice."""
+    return {"stopwords": ANALYZER_STOPWORDS, "stemming": ANALYZER_STEMMING, "unicode": "NFKD"}
+
+
+class Analyzer:
+    """
+    Análisis léxico compartido por BM25L, TF-IDF y la búsqueda por palabras
+    clave: minúsculas, sin tildes ni signos de puntuación y, opcionalmente,
+    sin palabras vacías y con stemming (Snowball en español, requiere nltk).
+
+    Mantiene el vocabulario término -> id. Los fragmentos se analizan una
+    sola vez al indexarlos y los índices léxicos guardan solo sus ids.
+    """
+    def __init__(self, stopwords: bool = ANALYZER_STOPWORDS, stemming: bool = ANALYZER_STEMMING):
+        self.stopwords = frozenset(self.normalize(word) for word in SPANISH_STOPWORDS) if stopwords else frozenset()
+        self.stemming = stemming
+        self.vocabulary: Dict[str, int] = {}
+        self._stems: Dict[str, str] = {}
+        self._stemmer = self._load_stemmer() if stemming else None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_stemmer"] = None
+        # Solo es una caché, y las consultas la amplían mientras se guarda el índice
+        state["_stems"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.stemming:
+            self._stemmer = self._load_stemmer()
+
+    @staticmethod
+    def _load_stemmer():
+        # Se carga al crear el analizador: sin nltk el índice no se puede
+        # construir ni consultar, y es mejor no arrancar que fallar en cada consulta
+        try:
+            from nltk.stem.snowball import SpanishStemmer
+        except ImportError as e:
+            raise ImportError("ANALYZER_STEMMING=true requires nltk (pip install nltk)") from e
+        return SpanishStemmer()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # NFKD como normalize_query: un acento descompuesto (e + U+0301) no parte la palabra
+        text = unicodedata.normalize("NFKD", text.lower())
+        return unicodedata.normalize("NFC", COMBINING_MARKS.sub("", text))
+
+    def _stem(self, word: str) -> str:
+        stem = self._stems.get(word)
+        if stem is None:
+            stem = self._stems[word] = self._stemmer.stem(word)
+        return stem
+
+    def tokens(self, text: str) -> List[str]:
+        words = [word for word in TOKEN_PATTERN.findall(self.normalize(text)) if word not in self.stopwords]
+        if self.stemming:
+            return [self._stem(word) for word in words]
+        return words
+
+    def encode(self, text: str, grow: bool = False) -> np.ndarray:
+        """
+        Ids de término de `text` en orden. Con `grow` (al indexar) los
+        términos nuevos se añaden al vocabulario; sin él (consultas) se
+        descartan.
+        """
+        if grow:
+            ids = [self.vocabulary.setdefault(token, len(self.vocabulary)) for token in self.tokens(text)]
+        else:
+            lookup = (self.vocabulary.get(token) for token in self.tokens(text))
+            ids = [term_id for term_id in lookup if term_id is not None]
+        return np.asarray(ids, dtype=np.int32)
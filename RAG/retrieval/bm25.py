@@ -1,65 +1,338 @@
-from typing import List, Tuple
+from typing import List, Optional, Sequence, Tuple
+import copy
 import numpy as np
-from collections import defaultdict
-import heapq
+from collections import Counter, defaultdict
+from scipy import sparse
+
+
+def _select_top_k(doc_ids: np.ndarray, scores: np.ndarray, top_k: int,
+                  allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    Selecciona los top_k (id, puntuación) ordenados de mayor a menor puntuación.
+    Si se da `allowed` (máscara booleana por documento), solo se consideran
+    los documentos permitidos.
+    """
+    if allowed is not None and len(doc_ids):
+        keep = allowed[doc_ids]
+        doc_ids, scores = doc_ids[keep], scores[keep]
+    if top_k <= 0 or len(doc_ids) == 0:
+        return []
+    if len(doc_ids) > top_k:
+        selected = np.argpartition(-scores, top_k - 1)[:top_k]
+        doc_ids, scores = doc_ids[selected], scores[selected]
+    order = np.lexsort((doc_ids, -scores))
+    return [(int(doc_ids[i]), float(scores[i])) for i in order]
 
 
 class BM25L:
     """
     Implementa el algoritmo BM25L para la recuperación de información.
+
+    Documentos y consultas llegan ya analizados como arrays de ids de
+    término (retrieval.analyzer); `corpus` guarda los de cada documento.
+    El corpus se guarda como un índice invertido (término -> ids de documento
+    y frecuencias), de modo que una consulta solo recorre los documentos que
+    contienen alguno de sus términos. Admite añadir y eliminar documentos sin
+    reconstruir el índice: los eliminados dejan un hueco (su id no se reutiliza)
+    y las estadísticas globales (frecuencias documentales, longitud media, IDF)
+    se recalculan de forma vectorizada.
     """
-    def __init__(self, corpus, k1=1.5, b=0.75, delta=0.5):
+    def __init__(self, corpus: List[np.ndarray], k1=1.5, b=0.75, delta=0.5):
         self.corpus = corpus
         self.k1 = k1
         self.b = b
         self.delta = delta
-        self.avg_doc_len = sum(len(doc.split()) for doc in corpus) / len(corpus)
-        self.doc_freqs = []
-        self.idf = defaultdict(float)
-        self.doc_len = []
-        self.corpus_size = len(corpus)
+        self.corpus_size = 0
+        self.postings_docs: List[np.ndarray] = []
+        self.postings_tfs: List[np.ndarray] = []
+        self.doc_freqs = np.zeros(0, dtype=np.float64)
+        self.doc_len = np.zeros(0, dtype=np.float64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.avg_doc_len = 0.0
+        self.idf = np.zeros(0, dtype=np.float64)
+        self.doc_norm = np.zeros(0, dtype=np.float64)
         self._initialize()
 
     def _initialize(self):
-        for document in self.corpus:
-            words = document.split()
-            self.doc_len.append(len(words))
-            freq_dict = defaultdict(int)
-            for word in words:
-                freq_dict[word] += 1
-            self.doc_freqs.append(freq_dict)
-            for word in freq_dict:
-                self.idf[word] += 1
-
-        for word, freq in self.idf.items():
-            self.idf[word] = np.log((self.corpus_size - freq + 0.5) / (freq + 0.5))
-
-    def get_scores(self, query):
-        scores = [0] * self.corpus_size
-        query_words = query.split()
-        q_freqs = defaultdict(int)
-        for word in query_words:
-            q_freqs[word] += 1
-
-        for i, doc in enumerate(self.corpus):
-            for word in query_words:
-                if word not in self.doc_freqs[i]:
-                    continue
-                freq = self.doc_freqs[i][word]
-                numerator = self.idf[word] * freq * (self.k1 + 1)
-                denominator = freq + self.k1 * (1 - self.b + self.b * self.doc_len[i] / self.avg_doc_len)
-                scores[i] += (numerator / denominator) + self.delta
-
-        return scores
+        self._index_documents(0, self.corpus)
+        self._refresh_statistics()
+
+    def _index_documents(self, start: int, documents: Sequence[np.ndarray]):
+        """
+        Añade a las listas de postings los documentos dados, con ids
+        consecutivos a partir de `start`.
+        """
+        term_docs = defaultdict(list)
+        term_tfs = defaultdict(list)
+        lengths = []
+        n_terms = len(self.postings_docs)
+        for offset, term_ids in enumerate(documents):
+            lengths.append(len(term_ids))
+            for term_id, freq in Counter(term_ids.tolist()).items():
+                term_docs[term_id].append(start + offset)
+                term_tfs[term_id].append(freq)
+                n_terms = max(n_terms, term_id + 1)
+
+        new_terms = n_terms - len(self.postings_docs)
+        self.postings_docs.extend(np.zeros(0, dtype=np.int32) for _ in range(new_terms))
+        self.postings_tfs.extend(np.zeros(0, dtype=np.float64) for _ in range(new_terms))
+        self.doc_freqs = np.concatenate([self.doc_freqs, np.zeros(new_terms, dtype=np.float64)])
+        for term_id, docs in term_docs.items():
+            self.postings_docs[term_id] = np.concatenate(
+                [self.postings_docs[term_id], np.asarray(docs, dtype=np.int32)]
+            )
+            self.postings_tfs[term_id] = np.concatenate(
+                [self.postings_tfs[term_id], np.asarray(term_tfs[term_id], dtype=np.float64)]
+            )
+            self.doc_freqs[term_id] += len(docs)
+
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.float64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(lengths), dtype=bool)])
+
+    def _refresh_statistics(self):
+        self.corpus_size = int(self.alive.sum())
+        self.idf = np.log((self.corpus_size - self.doc_freqs + 0.5) / (self.doc_freqs + 0.5))
+        self.avg_doc_len = self.doc_len[self.alive].mean() if self.corpus_size else 0.0
+        # Parte del denominador que solo depende de la longitud del documento
+        self.doc_norm = self.k1 * (1 - self.b + self.b * self.doc_len / (self.avg_doc_len or 1.0))
+
+    def copy(self) -> "BM25L":
+        """
+        Copia que se puede modificar sin afectar a las búsquedas en curso
+        sobre este índice. Las listas de postings no cambiadas se comparten:
+        añadir o eliminar documentos sustituye los arrays, no los modifica.
+        """
+        clone = copy.copy(self)
+        clone.corpus = list(self.corpus)
+        clone.postings_docs = list(self.postings_docs)
+        clone.postings_tfs = list(self.postings_tfs)
+        clone.doc_freqs = self.doc_freqs.copy()
+        clone.doc_len = self.doc_len.copy()
+        clone.alive = self.alive.copy()
+        return clone
+
+    def add_documents(self, documents: Sequence[np.ndarray]) -> List[int]:
+        """
+        Indexa nuevos documentos (ids de término) y devuelve sus ids.
+        """
+        start = len(self.corpus)
+        self.corpus.extend(documents)
+        self._index_documents(start, documents)
+        self._refresh_statistics()
+        return list(range(start, start + len(documents)))
+
+    def remove_documents(self, doc_ids: Sequence[int]):
+        """
+        Elimina documentos del índice. Solo se reescriben las listas de
+        postings de los términos que aparecían en ellos.
+        """
+        removed = np.asarray([i for i in set(doc_ids) if self.alive[i]], dtype=np.int32)
+        if len(removed) == 0:
+            return
+        affected = {term_id for i in removed for term_id in self.corpus[i].tolist()}
+        for term_id in affected:
+            keep = ~np.isin(self.postings_docs[term_id], removed)
+            self.postings_docs[term_id] = self.postings_docs[term_id][keep]
+            self.postings_tfs[term_id] = self.postings_tfs[term_id][keep]
+            self.doc_freqs[term_id] = len(self.postings_docs[term_id])
+        for i in removed:
+            self.corpus[i] = np.zeros(0, dtype=np.int32)
+        self.alive[removed] = False
+        self.doc_len[removed] = 0
+        self._refresh_statistics()
+
+    def _accumulate(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Suma las contribuciones de cada término de la consulta recorriendo
+        solo sus listas de postings. Devuelve (ids de documento, puntuaciones).
+        """
+        doc_parts = []
+        score_parts = []
+        for term_id, q_freq in Counter(query.tolist()).items():
+            if term_id >= len(self.postings_docs):
+                continue
+            docs = self.postings_docs[term_id]
+            tfs = self.postings_tfs[term_id]
+            numerator = self.idf[term_id] * tfs * (self.k1 + 1)
+            denominator = tfs + self.doc_norm[docs]
+            doc_parts.append(docs)
+            score_parts.append(q_freq * (numerator / denominator + self.delta))
+
+        if not doc_parts:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        if len(doc_parts) == 1:
+            return doc_parts[0], score_parts[0]
+
+        doc_ids, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        return doc_ids, scores
+
+    def matching_documents(self, query: np.ndarray,
+                           allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Documentos que contienen algún término de la consulta y cuántos
+        términos distintos de la consulta contiene cada uno. Solo recorre las
+        postings de esos términos, no el corpus.
+        """
+        parts = [self.postings_docs[term_id] for term_id in set(query.tolist()) if term_id < len(self.postings_docs)]
+        if not parts:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        doc_ids, counts = np.unique(np.concatenate(parts), return_counts=True)
+        if allowed is not None:
+            keep = allowed[doc_ids]
+            doc_ids, counts = doc_ids[keep], counts[keep]
+        return doc_ids, counts
+
+    def get_scores(self, query: np.ndarray):
+        scores = np.zeros(len(self.corpus), dtype=np.float64)
+        doc_ids, doc_scores = self._accumulate(query)
+        scores[doc_ids] = doc_scores
+        return scores.tolist()
+
+    def get_top_k(self, query: np.ndarray, top_k: int = 10,
+                  allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Devuelve los top_k documentos que contienen algún término de la
+        consulta, sin construir la lista completa de puntuaciones.
+        """
+        doc_ids, scores = self._accumulate(query)
+        return _select_top_k(doc_ids, scores, top_k, allowed)
+
+    def get_top_k_batch(self, queries: Sequence[np.ndarray], top_k: int = 10,
+                        allowed: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        return [self.get_top_k(query, top_k=top_k, allowed=allowed) for query in queries]
+
+
+class BM25LSparse(BM25L):
+    """
+    Variante de BM25L que guarda el corpus como una matriz CSR
+    documento-término con los pesos BM25L ya calculados (IDF y denominador
+    por documento incluidos). Puntuar una consulta es un producto
+    matriz-vector disperso, y un lote de consultas un único producto
+    matriz-matriz.
+    """
+    def _refresh_statistics(self):
+        # Los pesos dependen del IDF y la longitud media: tras cada cambio
+        # del corpus se regenera la matriz a partir de las postings.
+        super()._refresh_statistics()
+        self.matrix = self._build_matrix()
+
+    def _build_matrix(self) -> sparse.csr_matrix:
+        lengths = np.array([len(docs) for docs in self.postings_docs], dtype=np.int64)
+        rows = np.concatenate(self.postings_docs) if len(lengths) else np.zeros(0, dtype=np.int32)
+        cols = np.repeat(np.arange(len(self.postings_docs)), lengths)
+        tfs = np.concatenate(self.postings_tfs) if len(lengths) else np.zeros(0, dtype=np.float64)
+        weights = self.idf[cols] * tfs * (self.k1 + 1) / (tfs + self.doc_norm[rows]) + self.delta
+        return sparse.csr_matrix((weights, (rows, cols)), shape=(len(self.corpus), len(self.postings_docs)))
+
+    def _query_matrix(self, queries: Sequence[np.ndarray]) -> sparse.csr_matrix:
+        """
+        Codifica las consultas como una matriz dispersa consulta-término de
+        frecuencias (los términos fuera del vocabulario se ignoran).
+        """
+        rows, cols, data = [], [], []
+        for row, query in enumerate(queries):
+            for term_id, q_freq in Counter(query.tolist()).items():
+                if term_id < len(self.postings_docs):
+                    rows.append(row)
+                    cols.append(term_id)
+                    data.append(q_freq)
+        return sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float64), (rows, cols)),
+            shape=(len(queries), len(self.postings_docs))
+        )
+
+    def get_batch_scores(self, queries: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Puntuaciones de todos los documentos para cada consulta, con forma
+        (n_consultas, n_documentos).
+        """
+        return (self._query_matrix(queries) @ self.matrix.T).toarray()
+
+    def get_scores(self, query: np.ndarray):
+        return self.get_batch_scores([query])[0].tolist()
+
+    def get_top_k_batch(self, queries: Sequence[np.ndarray], top_k: int = 10,
+                        allowed: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        # Documento x consulta en CSC: cada columna contiene solo los
+        # documentos que comparten algún término con esa consulta.
+        scores = (self.matrix @ self._query_matrix(queries).T).tocsc()
+        results = []
+        for col in range(len(queries)):
+            start, end = scores.indptr[col], scores.indptr[col + 1]
+            results.append(_select_top_k(scores.indices[start:end], scores.data[start:end], top_k, allowed))
+        return results
+
+    def get_top_k(self, query: np.ndarray, top_k: int = 10,
+                  allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        return self.get_top_k_batch([query], top_k=top_k, allowed=allowed)[0]
+
+
+BM25L_BACKENDS = {
+    "postings": BM25L,
+    "sparse": BM25LSparse,
+}
+
 
 class BM25LRetriever:
     """
-    Recuperador utilizando el algoritmo BM25L.
+    Recuperador utilizando el algoritmo BM25L. `documents` son los ids de
+    término de cada fragmento, calculados una vez al indexarlo.
     """
-    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75, delta: float = 0.5):
-        self.documents = documents
-        self.bm25 = BM25L(self.documents, k1=k1, b=b, delta=delta)
+    def __init__(self, documents: Sequence[np.ndarray], k1: float = 1.5, b: float = 0.75, delta: float = 0.5,
+                 backend: str = "postings"):
+        if backend not in BM25L_BACKENDS:
+            raise ValueError(f"Unknown BM25L backend: {backend}")
+        self.documents = list(documents)
+        self.bm25 = BM25L_BACKENDS[backend](self.documents, k1=k1, b=b, delta=delta)
+
+    def copy(self) -> "BM25LRetriever":
+        clone = copy.copy(self)
+        clone.bm25 = self.bm25.copy()
+        clone.documents = clone.bm25.corpus
+        return clone
+
+    @property
+    def backend(self) -> str:
+        return next(name for name, cls in BM25L_BACKENDS.items() if type(self.bm25) is cls)
+
+    def with_backend(self, backend: str) -> "BM25LRetriever":
+        """
+        El mismo índice con otro backend. Ambos comparten las postings, así
+        que un índice guardado con un backend se convierte al cargarlo sin
+        volver a analizar el corpus.
+        """
+        if backend not in BM25L_BACKENDS:
+            raise ValueError(f"Unknown BM25L backend: {backend}")
+        if backend == self.backend:
+            return self
+        bm25 = BM25L_BACKENDS[backend].__new__(BM25L_BACKENDS[backend])
+        bm25.__dict__.update({key: value for key, value in self.bm25.__dict__.items() if key != "matrix"})
+        bm25._refresh_statistics()
+        clone = copy.copy(self)
+        clone.bm25 = bm25
+        return clone
+
+    def add_documents(self, documents: Sequence[np.ndarray]) -> List[int]:
+        return self.bm25.add_documents(documents)
+
+    def remove_documents(self, doc_ids: Sequence[int]):
+        self.bm25.remove_documents(doc_ids)
+
+    def retrieve(self, query: np.ndarray, top_k: int = 10,
+                 allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        return self.bm25.get_top_k(query, top_k=top_k, allowed=allowed)
+
+    def keyword_search(self, query: np.ndarray, top_k: int = 3,
+                       allowed: Optional[np.ndarray] = None) -> List[int]:
+        """
+        Ids de los documentos con más términos de la consulta (a igualdad,
+        el de menor id). No depende de las puntuaciones BM25L ni de los
+        embeddings.
+        """
+        doc_ids, counts = self.bm25.matching_documents(query, allowed)
+        return doc_ids[np.lexsort((doc_ids, -counts))[:top_k]].tolist()
 
-    def retrieve(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
-        doc_scores = self.bm25.get_scores(query)
-        return heapq.nlargest(top_k, enumerate(doc_scores), key=lambda x: x[1])
+    def retrieve_batch(self, queries: Sequence[np.ndarray], top_k: int = 10,
+                       allowed: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        return self.bm25.get_top_k_batch(queries, top_k=top_k, allowed=allowed)
@@ -0,0 +1,63 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+Ranking = Sequence[Tuple[str, float]]
+
+
+def normalize_scores(ranking: Ranking) -> Dict[str, float]:
+    """
+    Normaliza las puntuaciones de una rama a [0, 1] (min-max). Si todas son
+    iguales, cada fragmento recibe 1.
+    """
+    if not ranking:
+        return {}
+    scores = [score for _, score in ranking]
+    low, high = min(scores), max(scores)
+    if high == low:
+        return {chunk_id: 1.0 for chunk_id, _ in ranking}
+    return {chunk_id: (score - low) / (high - low) for chunk_id, score in ranking}
+
+
+def weighted_score_fusion(rankings: Dict[str, Ranking], weights: Dict[str, float]) -> Dict[str, float]:
+    """
+    Suma ponderada de las puntuaciones normalizadas de cada rama.
+    """
+    fused: Dict[str, float] = {}
+    for branch, ranking in rankings.items():
+        weight = weights.get(branch, 1.0)
+        for chunk_id, score in normalize_scores(ranking).items():
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight * score
+    return fused
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, Ranking], weights: Dict[str, float], k: int = 60) -> Dict[str, float]:
+    """
+    Reciprocal Rank Fusion: cada rama aporta weight / (k + posición). Solo
+    usa el orden, así que no depende de la escala de las puntuaciones.
+    """
+    fused: Dict[str, float] = {}
+    for branch, ranking in rankings.items():
+        weight = weights.get(branch, 1.0)
+        ordered = sorted(ranking, key=lambda item: item[1], reverse=True)
+        for rank, (chunk_id, _) in enumerate(ordered, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (k + rank)
+    return fused
+
+
+def fuse(rankings: Dict[str, Ranking], method: str = "weighted", weights: Optional[Dict[str, float]] = None,
+         top_k: Optional[int] = None, rrf_k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Combina los resultados (chunk_id, puntuación) de varias ramas de
+    recuperación. Los fragmentos se identifican por chunk_id, así que un
+    mismo fragmento devuelto por varias ramas se acumula en una sola entrada.
+    El coste es lineal en el número de candidatos, no en el tamaño del corpus.
+    """
+    weights = weights or {}
+    if method == "rrf":
+        fused = reciprocal_rank_fusion(rankings, weights, k=rrf_k)
+    elif method == "weighted":
+        fused = weighted_score_fusion(rankings, weights)
+    else:
+        raise ValueError(f"Unknown fusion method: {method}")
+    ordered = sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+    return ordered[:top_k] if top_k is not None else ordered
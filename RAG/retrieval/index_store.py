@@ -0,0 +1,145 @@
+from typing import List, Optional
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import joblib
+from langchain.schema import Document
+
+from retrieval.analyzer import analyzer_config
+from utils.helpers import load_json, save_json, sha256_file
+
+
+class IndexStore:
+    """
+    Persistencia en disco de un índice de recuperación: manifiesto, fragmentos,
+    analizador léxico, estado de BM25L e índice TF-IDF. El índice vectorial (colección de Chroma
+    o ficheros del VectorStore) vive en el mismo directorio.
+
+    El manifiesto identifica el contenido indexado (hash de cada PDF,
+    parámetros de fragmentación y modelo de embeddings). Si los parámetros
+    coinciden con los guardados, el índice se reabre sin volver a generar
+    embeddings y solo se actualizan los PDFs cuyo hash cambió.
+    """
+    FORMAT_VERSION = 4
+    MANIFEST_FILE = "index_manifest.json"
+    CHUNKS_FILE = "chunks.json"
+    BM25L_FILE = "bm25l.joblib"
+    TFIDF_FILE = "tfidf.joblib"
+    ANALYZER_FILE = "analyzer.joblib"
+    INGESTION_FILE = "ingestion.json"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def fingerprint(manifest: dict) -> str:
+        content = {key: value for key, value in manifest.items() if key != "fingerprint"}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def build_manifest(pdf_files: List[str], chunk_size: int, chunk_overlap: int, embedding_model: str,
+                       vector_backend: str = "chroma") -> dict:
+        manifest = {
+            "format": IndexStore.FORMAT_VERSION,
+            "embedding_model": embedding_model,
+            "vector_backend": vector_backend,
+            "analyzer": analyzer_config(),
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "documents": {
+                pdf_file: sha256_file(pdf_file)
+                for pdf_file in pdf_files
+                if os.path.exists(pdf_file)
+            },
+        }
+        manifest["fingerprint"] = IndexStore.fingerprint(manifest)
+        return manifest
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def stored_manifest(self) -> dict:
+        if not os.path.exists(self._path(self.MANIFEST_FILE)):
+            return {}
+        return load_json(self._path(self.MANIFEST_FILE))
+
+    def is_compatible(self, manifest: dict) -> bool:
+        """
+        Indica si el índice en disco se puede reutilizar (mismo formato,
+        modelo de embeddings, índice vectorial, analizador y fragmentación),
+        aunque difieran los documentos.
+        """
+        files = (self.MANIFEST_FILE, self.CHUNKS_FILE, self.BM25L_FILE, self.TFIDF_FILE, self.ANALYZER_FILE)
+        if not all(os.path.exists(self._path(f)) for f in files):
+            return False
+        stored = self.stored_manifest()
+        keys = ("format", "embedding_model", "chunk_size", "chunk_overlap", "analyzer")
+        # Los índices anteriores a VECTOR_BACKEND usaban Chroma
+        return all(stored.get(key) == manifest.get(key) for key in keys) and \
+            stored.get("vector_backend", "chroma") == manifest.get("vector_backend", "chroma")
+
+    def reset(self):
+        """
+        Elimina el índice persistido (incluida la colección de Chroma) para
+        reconstruirlo desde cero. El registro de ingestas se conserva.
+        """
+        ingestion = self.load_ingestion()
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        if ingestion:
+            self.save_ingestion(ingestion)
+
+    def save(self, manifest: dict, docs: List[Optional[Document]], bm25l_retriever, tfidf_index, analyzer):
+        os.makedirs(self.directory, exist_ok=True)
+        save_json(
+            [
+                {"page_content": doc.page_content, "metadata": doc.metadata} if doc is not None else None
+                for doc in docs
+            ],
+            self._path(self.CHUNKS_FILE)
+        )
+        joblib.dump(bm25l_retriever, self._path(self.BM25L_FILE))
+        joblib.dump(tfidf_index, self._path(self.TFIDF_FILE))
+        joblib.dump(analyzer, self._path(self.ANALYZER_FILE))
+        # El manifiesto se escribe al final: un guardado interrumpido no deja
+        # un índice marcado como vigente.
+        save_json(manifest, self._path(self.MANIFEST_FILE))
+        logging.info("Index saved to %s", self.directory)
+
+    def load(self) -> Optional[tuple]:
+        """
+        Devuelve (docs, bm25l_retriever, tfidf_index, analyzer) o None si el índice
+        no se puede leer. Los fragmentos eliminados aparecen como None.
+        """
+        try:
+            chunks = load_json(self._path(self.CHUNKS_FILE))
+            if not chunks:
+                return None
+            docs = [
+                Document(page_content=c["page_content"], metadata=c["metadata"]) if c is not None else None
+                for c in chunks
+            ]
+            bm25l_retriever = joblib.load(self._path(self.BM25L_FILE))
+            tfidf_index = joblib.load(self._path(self.TFIDF_FILE))
+            analyzer = joblib.load(self._path(self.ANALYZER_FILE))
+            return docs, bm25l_retriever, tfidf_index, analyzer
+        except Exception as e:
+            logging.error("Error loading index from %s: %s", self.directory, str(e))
+            return None
+
+    def load_ingestion(self) -> dict:
+        """
+        Registro de documentos añadidos o eliminados mediante ingesta:
+        {"added": {pdf: [roles]}, "removed": [pdf, ...]}.
+        """
+        path = self._path(self.INGESTION_FILE)
+        if not os.path.exists(path):
+            return {}
+        return load_json(path)
+
+    def save_ingestion(self, record: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        save_json(record, self._path(self.INGESTION_FILE))
@@ -0,0 +1,165 @@
+from typing import Callable, Dict, List, Optional
+import copy
+import logging
+import os
+import threading
+
+from config.roles import ROLE_PDF_MAPPING
+from config.settings import VECTOR_BACKEND
+from loaders.pdf_loader import PDFLoaderService
+from retrieval.index_store import IndexStore
+from retrieval.retrieval_system import RetrievalSystem
+from utils.helpers import sha256_file
+
+
+def document_source(path: str) -> str:
+    """
+    Clave con la que se indexa un PDF: ruta real relativa al directorio de
+    trabajo, como las de ROLE_PDF_MAPPING. Así `./Salarios.pdf` y
+    `Salarios.pdf` son el mismo documento.
+    """
+    return os.path.relpath(os.path.realpath(path))
+
+
+def resolve_role_pdf_mapping(ingestion: dict) -> Dict[str, List[str]]:
+    """
+    Combina ROLE_PDF_MAPPING con el registro de ingestas: los PDFs retirados
+    desaparecen de todos los roles y los añadidos se asignan a los roles con
+    los que se ingirieron (sustituyendo su asignación estática).
+    """
+    mapping = copy.deepcopy(ROLE_PDF_MAPPING)
+    added = ingestion.get("added", {})
+    overridden = set(ingestion.get("removed", [])) | set(added)
+    for pdfs in mapping.values():
+        pdfs[:] = [pdf for pdf in pdfs if pdf not in overridden]
+    for pdf_file, roles in added.items():
+        for role in roles:
+            mapping.setdefault(role, []).append(pdf_file)
+    return mapping
+
+
+def open_retrieval_system(pdf_files: List[str], chunk_size: int, chunk_overlap: int,
+                          embedding_model: str) -> Optional[RetrievalSystem]:
+    """
+    Reabre el índice compartido y lo actualiza de forma incremental con los
+    PDFs dados, o lo construye desde cero si no existe o no es compatible.
+    """
+    manifest = IndexStore.build_manifest(
+        pdf_files,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model=embedding_model,
+        vector_backend=VECTOR_BACKEND
+    )
+    retrieval_system = RetrievalSystem.from_store(manifest)
+    if retrieval_system is not None:
+        retrieval_system.sync(
+            manifest,
+            lambda pdf_file: PDFLoaderService([pdf_file], chunk_size, chunk_overlap).load_pdfs()
+        )
+        return retrieval_system
+
+    docs = PDFLoaderService(pdf_files, chunk_size, chunk_overlap).load_pdfs()
+    if not docs:
+        return None
+    return RetrievalSystem(docs, manifest=manifest)
+
+
+class IngestionService:
+    """
+    Añade, reemplaza o elimina un documento del índice compartido sin
+    reconstruirlo, y mantiene la asignación de PDFs por rol.
+
+    `role_pdf_mapping` se modifica en el sitio para que las vistas por rol
+    que ya la referencian vean los cambios. Las ingestas se serializan con
+    `_lock`: la asignación de roles, el índice y el registro de ingestas
+    cambian juntos, y si falla la indexación se restaura la asignación.
+    """
+    def __init__(self, retrieval_system: RetrievalSystem, role_pdf_mapping: Dict[str, List[str]],
+                 chunk_size: int, chunk_overlap: int):
+        self.retrieval_system = retrieval_system
+        self.role_pdf_mapping = role_pdf_mapping
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.index_store = retrieval_system.index_store
+        self._lock = threading.Lock()
+
+    def _record(self, pdf_file: str, roles: Optional[List[str]]):
+        ingestion = self.index_store.load_ingestion()
+        added = ingestion.setdefault("added", {})
+        removed = ingestion.setdefault("removed", [])
+        if roles is None:
+            added.pop(pdf_file, None)
+            if pdf_file not in removed:
+                removed.append(pdf_file)
+        else:
+            added[pdf_file] = roles
+            if pdf_file in removed:
+                removed.remove(pdf_file)
+        self.index_store.save_ingestion(ingestion)
+
+    def _assign_roles(self, pdf_file: str, roles: List[str]):
+        for role in roles:
+            self.role_pdf_mapping.setdefault(role, [])
+        for role, pdfs in self.role_pdf_mapping.items():
+            if role in roles and pdf_file not in pdfs:
+                pdfs.append(pdf_file)
+            elif role not in roles and pdf_file in pdfs:
+                pdfs.remove(pdf_file)
+
+    def _restore_roles(self, previous: Dict[str, List[str]]):
+        for role in list(self.role_pdf_mapping):
+            if role not in previous:
+                del self.role_pdf_mapping[role]
+        for role, pdfs in previous.items():
+            self.role_pdf_mapping[role][:] = pdfs
+
+    def _apply(self, pdf_file: str, roles: List[str], update: Callable[[], dict]) -> dict:
+        """
+        Asigna `roles` a `pdf_file`, ejecuta `update` sobre el índice y
+        registra la ingesta. Si `update` falla, la asignación de roles vuelve
+        a la anterior y no se registra nada.
+        """
+        previous = {role: list(pdfs) for role, pdfs in self.role_pdf_mapping.items()}
+        self._assign_roles(pdf_file, roles)
+        try:
+            stats = update()
+        except Exception:
+            self._restore_roles(previous)
+            raise
+        self._record(pdf_file, roles or None)
+        return stats
+
+    def add_document(self, pdf_file: str, roles: Optional[List[str]] = None) -> dict:
+        """
+        Ingiere (o reingiere) un PDF. Si no se indican roles se conservan los
+        que ya tuviera el documento.
+        """
+        pdf_file = document_source(pdf_file)
+        if not os.path.exists(pdf_file):
+            raise FileNotFoundError(pdf_file)
+        chunks = PDFLoaderService([pdf_file], self.chunk_size, self.chunk_overlap).load_pdfs()
+        if not chunks:
+            raise ValueError(f"No text could be extracted from {pdf_file}")
+
+        with self._lock:
+            if not roles:
+                roles = [role for role, pdfs in self.role_pdf_mapping.items() if pdf_file in pdfs]
+            if not roles:
+                raise ValueError(f"No roles given for new document: {pdf_file}")
+            sha256 = sha256_file(pdf_file)
+            stats = self._apply(
+                pdf_file, roles,
+                lambda: self.retrieval_system.upsert_document(pdf_file, chunks, sha256)
+            )
+        logging.info("Ingested %s for roles %s", pdf_file, roles)
+        return dict(stats, roles=roles)
+
+    def remove_document(self, pdf_file: str) -> dict:
+        pdf_file = document_source(pdf_file)
+        with self._lock:
+            stats = self._apply(
+                pdf_file, [], lambda: self.retrieval_system.remove_document(pdf_file)
+            )
+        logging.info("Removed %s from the index", pdf_file)
+        return dict(stats, roles=[])
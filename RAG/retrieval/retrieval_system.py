@@ -1,46 +1,450 @@
-from typing import List
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from sklearn.feature_extraction.text import TfidfVectorizer
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 import logging
+import threading
+import time
+import numpy as np
 
+from retrieval.analyzer import Analyzer
 from retrieval.bm25 import BM25LRetriever
+from retrieval.index_store import IndexStore
+from retrieval.tfidf import TfidfIndex
+from retrieval.vector_store import VectorStore, vector_store_class
+from models.registry import get_embeddings
+from config.settings import BM25_BACKEND, EMBEDDING_MODEL, INDEX_DIRECTORY, VECTOR_BACKEND
 from langchain.schema import Document
 
 
+@dataclass
+class IndexSnapshot:
+    """
+    Estado del índice en un momento dado: fragmentos, posiciones, BM25L,
+    TF-IDF e índice vectorial, siempre coherentes entre sí.
+
+    Un snapshot publicado no se modifica: las escrituras preparan uno nuevo
+    a partir de copias y lo sustituyen de una vez, de modo que las
+    búsquedas en curso (en hilos de los executors) siguen usando el suyo.
+    """
+    docs: List[Optional[Document]]
+    # chunk_id -> posición en `docs`
+    positions: Dict[str, int]
+    bm25l_retriever: Optional[BM25LRetriever] = None
+    tfidf_index: Optional[TfidfIndex] = None
+    vectorstore: Optional[VectorStore] = None
+    # Se incrementa con cada cambio del corpus (invalida las vistas por rol)
+    version: int = 0
+
+    def copy(self) -> "IndexSnapshot":
+        """Borrador modificable de la siguiente versión."""
+        return IndexSnapshot(
+            docs=list(self.docs),
+            positions=dict(self.positions),
+            bm25l_retriever=self.bm25l_retriever.copy(),
+            tfidf_index=self.tfidf_index.copy(),
+            vectorstore=self.vectorstore.copy() if self.vectorstore is not None else None,
+            version=self.version + 1,
+        )
+
+
+def _index_positions(docs: List[Optional[Document]]) -> Dict[str, int]:
+    return {
+        doc.metadata["chunk_id"]: idx
+        for idx, doc in enumerate(docs)
+        if doc is not None
+    }
+
+
 class RetrievalSystem:
     """
     Sistema de recuperación que integra vectores de embeddings, BM25L y TF-IDF.
+
+    Un único índice contiene los fragmentos de todos los PDFs, cada uno
+    etiquetado con su PDF de origen (metadato "source") y un id estable
+    ("chunk_id"); el acceso por rol se aplica al consultar mediante
+    `for_role`. Los documentos se pueden añadir, reemplazar o eliminar de uno
+    en uno: las posiciones en `docs` coinciden con los ids de BM25L y TF-IDF,
+    y los fragmentos eliminados quedan como None.
+
+    El estado vigente es `snapshot` (IndexSnapshot). Las escrituras se
+    serializan con `_lock` y publican un snapshot nuevo; las lecturas no
+    toman ningún lock.
     """
-    def __init__(self, docs: List[Document], role: str):  # Add role parameter
-        self.docs = docs
-        self.role = role  # Store the role
-        self.vectorstore = None
-        self.bm25l_retriever = None
-        self.tfidf_vectorizer = None
-        self._initialize()
+    def __init__(self, docs: List[Document], manifest: Optional[dict] = None):
+        self.manifest = manifest
+        self.persist_directory = INDEX_DIRECTORY
+        self.index_store = IndexStore(self.persist_directory)
+        self.analyzer = None
+        self.snapshot = IndexSnapshot(docs=docs if docs is not None else [], positions={})
+        # Versión de cada PDF: solo cambia cuando se reingiere o elimina ese PDF
+        self.source_versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if docs is not None:
+            self._initialize()
+
+    @property
+    def docs(self) -> List[Optional[Document]]:
+        return self.snapshot.docs
+
+    @property
+    def bm25l_retriever(self) -> Optional[BM25LRetriever]:
+        return self.snapshot.bm25l_retriever
+
+    @property
+    def tfidf_index(self) -> Optional[TfidfIndex]:
+        return self.snapshot.tfidf_index
+
+    @property
+    def vectorstore(self) -> Optional[VectorStore]:
+        return self.snapshot.vectorstore
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @classmethod
+    def from_store(cls, manifest: dict) -> Optional["RetrievalSystem"]:
+        """
+        Reabre el índice persistido si es compatible con el manifiesto dado
+        (mismo modelo de embeddings y fragmentación). Devuelve None cuando
+        hay que reconstruirlo; los documentos que difieran se actualizan
+        después con `sync`.
+
+        Si el índice vectorial no se puede reabrir (modelo de embeddings o
+        backend caídos) se conserva el estado léxico cargado sin índice
+        vectorial: el índice en disco no se toca y se vuelve a abrir
+        completo en el siguiente arranque.
+        """
+        system = cls(None)
+        if not system.index_store.is_compatible(manifest):
+            return None
+        loaded = system.index_store.load()
+        if loaded is None:
+            return None
+        docs, bm25l_retriever, tfidf_index, system.analyzer = loaded
+        if bm25l_retriever.backend != BM25_BACKEND:
+            logging.info("Converting BM25L index from %s to %s", bm25l_retriever.backend, BM25_BACKEND)
+            bm25l_retriever = bm25l_retriever.with_backend(BM25_BACKEND)
+        system.snapshot = IndexSnapshot(
+            docs=docs,
+            positions=_index_positions(docs),
+            bm25l_retriever=bm25l_retriever,
+            tfidf_index=tfidf_index,
+        )
+        system.manifest = system.index_store.stored_manifest()
+        try:
+            vectorstore = vector_store_class(VECTOR_BACKEND).open(
+                system.persist_directory, system._create_embeddings(), system.position
+            )
+        except Exception as e:
+            logging.error(f"Error reopening vector store, continuing with lexical search only: {str(e)}")
+            return system
+        if not vectorstore.is_consistent(len(docs)):
+            logging.warning("Vector store does not match the %d stored chunks; rebuilding the index", len(docs))
+            return None
+        system.snapshot = replace(system.snapshot, vectorstore=vectorstore)
+        logging.info("Retrieval systems loaded from disk")
+        return system
+
+    @staticmethod
+    def _create_embeddings():
+        return get_embeddings(EMBEDDING_MODEL)
 
     def _initialize(self):
+        started = time.perf_counter()
+        docs = self.snapshot.docs
+        # Un analizador mal configurado (stemming sin nltk) detiene el arranque:
+        # sin él no funciona ninguna búsqueda, ni siquiera la de respaldo
+        self.analyzer = Analyzer()
         try:
-            print(f"Creating retrieval systems for role: {self.role}")
-            # Create a unique persistent directory for each role
-            persist_directory = f"chroma_db_{self.role}"
+            print(f"Creating retrieval systems for {len(docs)} chunks")
+            # Cada fragmento se analiza una vez; BM25L y TF-IDF comparten sus ids
+            token_ids = [self.analyzer.encode(doc.page_content, grow=True) for doc in docs]
+            self.snapshot = IndexSnapshot(
+                docs=docs,
+                positions=_index_positions(docs),
+                bm25l_retriever=BM25LRetriever(token_ids, k1=1.2, b=0.75, delta=0.5, backend=BM25_BACKEND),
+                tfidf_index=TfidfIndex(token_ids),
+            )
+        except Exception as e:
+            logging.error(f"Error creating retrieval systems: {str(e)}")
+            return
 
-            embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2",
-                model_kwargs={'device': 'cpu'}
+        # Sin modelo de embeddings o sin índice vectorial la búsqueda léxica y
+        # por palabras clave siguen funcionando; el índice no se guarda para
+        # reconstruirlo completo en el siguiente arranque. El índice antiguo
+        # se descarta entero (Chroma.from_documents añadiría los fragmentos
+        # duplicados a la colección existente), pero solo cuando los nuevos
+        # embeddings ya están calculados.
+        try:
+            vectorstore = vector_store_class(VECTOR_BACKEND).build(
+                self.persist_directory, self._create_embeddings(), docs, self.position,
+                prepare=self.index_store.reset
             )
+        except Exception as e:
+            logging.error(f"Error creating vector store, continuing with lexical search only: {str(e)}")
+            return
+        self.snapshot = replace(self.snapshot, vectorstore=vectorstore)
+        self.save()
+        logging.info("Retrieval systems created successfully in %.1fs", time.perf_counter() - started)
 
-            # Use role-specific persistent storage
-            self.vectorstore = Chroma.from_documents(
-                documents=self.docs,
-                embedding=embeddings,
-                persist_directory=persist_directory
+    def save(self):
+        snapshot = self.snapshot
+        if self.manifest is not None and snapshot.vectorstore is not None:
+            snapshot.vectorstore.save()
+            self.index_store.save(
+                self.manifest, snapshot.docs, snapshot.bm25l_retriever, snapshot.tfidf_index, self.analyzer
             )
 
-            doc_texts = [doc.page_content for doc in self.docs]
-            self.bm25l_retriever = BM25LRetriever(doc_texts, k1=1.2, b=0.75, delta=0.5)
-            self.tfidf_vectorizer = TfidfVectorizer().fit(doc_texts)
-            logging.info(f"Retrieval systems created successfully for role: {self.role}")
-        except Exception as e:
-            logging.error(f"Error creating retrieval systems for role {self.role}: {str(e)}")
+    def position(self, chunk_id: str) -> Optional[int]:
+        """Posición del fragmento en `docs` (y en BM25L/TF-IDF), o None."""
+        return self.snapshot.positions.get(chunk_id)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Ids de término de la consulta con el analizador del índice."""
+        return self.analyzer.encode(query)
+
+    def _chunk_positions(self, source: str) -> Dict[str, int]:
+        return {
+            doc.metadata["chunk_id"]: idx
+            for idx, doc in enumerate(self.docs)
+            if doc is not None and doc.metadata.get("source") == source
+        }
+
+    def _add_chunks(self, draft: IndexSnapshot, chunks: List[Document]):
+        if not chunks:
+            return
+        docs = draft.docs
+        if draft.vectorstore is not None:
+            draft.vectorstore.add_documents(chunks, list(range(len(docs), len(docs) + len(chunks))))
+        token_ids = [self.analyzer.encode(chunk.page_content, grow=True) for chunk in chunks]
+        draft.bm25l_retriever.add_documents(token_ids)
+        draft.tfidf_index.add_documents(token_ids)
+        for chunk in chunks:
+            draft.positions[chunk.metadata["chunk_id"]] = len(docs)
+            docs.append(chunk)
+
+    def _remove_chunks(self, draft: IndexSnapshot, positions: Sequence[int]):
+        if not positions:
+            return
+        docs = draft.docs
+        if draft.vectorstore is not None:
+            draft.vectorstore.delete([docs[idx] for idx in positions], list(positions))
+        draft.bm25l_retriever.remove_documents(positions)
+        draft.tfidf_index.remove_documents(positions)
+        for idx in positions:
+            draft.positions.pop(docs[idx].metadata["chunk_id"], None)
+            docs[idx] = None
+
+    def _publish(self, draft: IndexSnapshot, source: str):
+        """
+        Sustituye el snapshot vigente por `draft`. La versión del PDF (clave
+        de la caché de respuestas) cambia después del snapshot: una respuesta
+        ya calculada con el contenido nuevo puede quedar guardada con la
+        versión anterior, que se invalida en la siguiente consulta, pero
+        nunca al revés.
+        """
+        # La matriz TF-IDF se reconstruye aquí y no en la primera consulta
+        draft.tfidf_index.document_matrix()
+        self.snapshot = draft
+        source_versions = dict(self.source_versions)
+        source_versions[source] = source_versions.get(source, 0) + 1
+        self.source_versions = source_versions
+
+    def _set_document_hash(self, source: str, sha256: Optional[str]):
+        documents = self.manifest.setdefault("documents", {})
+        if sha256 is None:
+            documents.pop(source, None)
+        else:
+            documents[source] = sha256
+        self.manifest["fingerprint"] = IndexStore.fingerprint(self.manifest)
+
+    def upsert_document(self, source: str, chunks: List[Document], sha256: str, persist: bool = True) -> dict:
+        """
+        Añade un documento o reemplaza su versión anterior. Solo se embeben e
+        indexan los fragmentos nuevos y solo se eliminan los que ya no existen;
+        los fragmentos sin cambios (mismo chunk_id) no se tocan.
+
+        Los cambios se aplican sobre una copia del snapshot vigente y se
+        publican al terminar: las consultas nunca ven un índice a medias y,
+        si falla el modelo de embeddings, el índice no cambia.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            existing = self._chunk_positions(source)
+            new_ids = {chunk.metadata["chunk_id"] for chunk in chunks}
+            to_remove = [idx for chunk_id, idx in existing.items() if chunk_id not in new_ids]
+            to_add = [chunk for chunk in chunks if chunk.metadata["chunk_id"] not in existing]
+            draft = self.snapshot.copy()
+            self._add_chunks(draft, to_add)
+            self._remove_chunks(draft, to_remove)
+            self._publish(draft, source)
+            self._set_document_hash(source, sha256)
+            if persist:
+                self.save()
+        logging.info("Document %s: %d chunks added, %d removed in %.1fs",
+                     source, len(to_add), len(to_remove), time.perf_counter() - started)
+        return {
+            "source": source,
+            "added": len(to_add),
+            "removed": len(to_remove),
+            "unchanged": len(existing) - len(to_remove),
+        }
+
+    def remove_document(self, source: str, persist: bool = True) -> dict:
+        with self._lock:
+            positions = list(self._chunk_positions(source).values())
+            draft = self.snapshot.copy()
+            self._remove_chunks(draft, positions)
+            self._publish(draft, source)
+            self._set_document_hash(source, None)
+            if persist:
+                self.save()
+        logging.info("Document %s: %d chunks removed", source, len(positions))
+        return {"source": source, "added": 0, "removed": len(positions), "unchanged": 0}
+
+    def sync(self, manifest: dict, load_document: Callable[[str], List[Document]]) -> bool:
+        """
+        Pone el índice al día con el manifiesto dado actualizando solo los
+        PDFs nuevos, modificados o retirados. Devuelve True si hubo cambios.
+        """
+        stored = dict(self.manifest.get("documents", {}))
+        wanted = manifest.get("documents", {})
+        changed = False
+        for source in stored:
+            if source not in wanted:
+                self.remove_document(source, persist=False)
+                changed = True
+        for source, sha256 in wanted.items():
+            if stored.get(source) != sha256:
+                self.upsert_document(source, load_document(source), sha256, persist=False)
+                changed = True
+        if changed:
+            self.save()
+        return changed
+
+    def for_role(self, role: str, sources: List[str]) -> "RoleRetrievalView":
+        return RoleRetrievalView(self, role, sources)
+
+
+class RoleRetrievalView:
+    """
+    Vista de un RetrievalSystem compartido restringida a los PDFs de un rol.
+    Las búsquedas vectorial, BM25L y TF-IDF solo devuelven fragmentos cuyo
+    origen está entre los PDFs permitidos.
+
+    `sources` se guarda por referencia: si la lista del rol cambia (ingesta
+    de documentos), la vista lo refleja cuando cambia la versión del índice.
+
+    Cada búsqueda usa el snapshot vigente al empezar. Una consulta que hace
+    varias búsquedas y después lee los fragmentos por posición debe usar
+    una vista fijada con `pin`, que ve el mismo snapshot de principio a fin
+    aunque entretanto se ingieran o eliminen documentos.
+    """
+    def __init__(self, retrieval_system: RetrievalSystem, role: str, sources: List[str]):
+        self.retrieval_system = retrieval_system
+        self.role = role
+        self.sources = sources
+        # Vistas fijadas: snapshot propio y vista de la que comparten las máscaras
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._parent: Optional["RoleRetrievalView"] = None
+        # (versión, máscara de fragmentos permitidos, ids permitidos)
+        self._masks_cache: Optional[Tuple[int, np.ndarray, np.ndarray]] = None
+
+    def pin(self) -> "RoleRetrievalView":
+        """Vista de este rol fijada al snapshot vigente."""
+        view = RoleRetrievalView(self.retrieval_system, self.role, self.sources)
+        view._snapshot = self.retrieval_system.snapshot
+        view._parent = self
+        return view
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snapshot if self._snapshot is not None else self.retrieval_system.snapshot
+
+    def _masks(self, snapshot: IndexSnapshot) -> Tuple[np.ndarray, np.ndarray]:
+        if self._parent is not None:
+            return self._parent._masks(snapshot)
+        cached = self._masks_cache
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1], cached[2]
+        allowed_sources = set(self.sources)
+        docs = snapshot.docs
+        allowed = np.fromiter(
+            (doc is not None and doc.metadata.get("source") in allowed_sources for doc in docs),
+            dtype=bool, count=len(docs)
+        )
+        doc_ids = np.flatnonzero(allowed)
+        # Una vista fijada a un snapshot antiguo no desplaza las máscaras del vigente
+        if cached is None or snapshot.version > cached[0]:
+            self._masks_cache = (snapshot.version, allowed, doc_ids)
+        return allowed, doc_ids
+
+    @property
+    def allowed(self) -> np.ndarray:
+        return self._masks(self.snapshot)[0]
+
+    @property
+    def doc_ids(self) -> np.ndarray:
+        return self._masks(self.snapshot)[1]
+
+    @property
+    def index_version(self) -> tuple:
+        """
+        Versión del índice visible para el rol: cambia si se modifica alguno
+        de sus PDFs o su lista de PDFs, pero no con cambios de otros roles.
+        """
+        versions = self.retrieval_system.source_versions
+        return tuple(sorted((source, versions.get(source, 0)) for source in set(self.sources)))
+
+    @property
+    def docs(self) -> List[Optional[Document]]:
+        # Lista global: los ids de BM25L y TF-IDF indexan sobre ella
+        return self.snapshot.docs
+
+    @property
+    def vectorstore(self):
+        return self.snapshot.vectorstore
+
+    @property
+    def tfidf_index(self):
+        return self.snapshot.tfidf_index
+
+    def position(self, chunk_id: str) -> Optional[int]:
+        return self.snapshot.positions.get(chunk_id)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.retrieval_system.encode_query(query)
+
+    def vector_search(self, query: str, k: int = 10,
+                      embedding: Optional[Sequence[float]] = None) -> List[Tuple[Document, float]]:
+        """(documento, relevancia) de mayor a menor relevancia."""
+        snapshot = self.snapshot
+        if snapshot.vectorstore is None:
+            raise RuntimeError("Vector store unavailable")
+        results = snapshot.vectorstore.search(
+            query, k, self.sources, self._masks(snapshot)[0], embedding=embedding
+        )
+        docs = snapshot.docs
+        # Chroma se actualiza en el sitio: puede devolver fragmentos añadidos
+        # después de este snapshot (las posiciones nunca se reutilizan)
+        return [
+            (docs[position], score) for position, score in results
+            if position < len(docs) and docs[position] is not None
+        ]
+
+    def keyword_search(self, query: str, top_k: int = 3) -> List[Document]:
+        """
+        Fragmentos del rol con más términos de la consulta, buscados en las
+        postings de BM25L: no usa embeddings ni el índice vectorial.
+        """
+        snapshot = self.snapshot
+        positions = snapshot.bm25l_retriever.keyword_search(
+            self.encode_query(query), top_k=top_k, allowed=self._masks(snapshot)[0]
+        )
+        return [snapshot.docs[idx] for idx in positions]
+
+    def bm25l_search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        snapshot = self.snapshot
+        return snapshot.bm25l_retriever.retrieve(
+            self.encode_query(query), top_k=top_k, allowed=self._masks(snapshot)[0]
+        )
@@ -0,0 +1,142 @@
+from typing import List, Optional, Sequence, Tuple
+from collections import Counter
+import copy
+
+import numpy as np
+from scipy import sparse
+
+
+class TfidfIndex:
+    """
+    Índice TF-IDF actualizable de forma incremental.
+
+    Reproduce la ponderación por defecto de TfidfVectorizer (IDF suavizado y
+    norma l2), pero guarda las frecuencias de cada documento y las
+    frecuencias documentales, de modo que añadir o quitar fragmentos no
+    obliga a reajustar el vocabulario sobre todo el corpus. Los términos son
+    los ids del analizador compartido (retrieval.analyzer).
+    """
+    def __init__(self, documents: Sequence[np.ndarray] = ()):
+        self.rows: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+        self.doc_freqs = np.zeros(0, dtype=np.float64)
+        self.n_docs = 0
+        self._matrix = None
+        self._idf = None
+        self.add_documents(documents)
+
+    @property
+    def idf_(self) -> np.ndarray:
+        return np.log((1 + self.n_docs) / (1 + self.doc_freqs)) + 1
+
+    def _cached_idf(self) -> np.ndarray:
+        if self._idf is None:
+            self._idf = self.idf_
+        return self._idf
+
+    def copy(self) -> "TfidfIndex":
+        """Copia que se puede modificar sin afectar a las búsquedas en curso sobre este índice."""
+        clone = copy.copy(self)
+        clone.rows = list(self.rows)
+        clone.doc_freqs = self.doc_freqs.copy()
+        return clone
+
+    def add_documents(self, documents: Sequence[np.ndarray]) -> List[int]:
+        """
+        Añade documentos (ids de término; el vocabulario crece si aparecen
+        términos nuevos) y devuelve sus ids.
+        """
+        start = len(self.rows)
+        for document in documents:
+            counts = Counter(document.tolist())
+            term_ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            tfs = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            self.rows.append((term_ids, tfs))
+            n_terms = int(term_ids.max()) + 1 if len(term_ids) else 0
+            if n_terms > len(self.doc_freqs):
+                self.doc_freqs = np.concatenate([self.doc_freqs, np.zeros(n_terms - len(self.doc_freqs))])
+            self.doc_freqs[term_ids] += 1
+            self.n_docs += 1
+        self._matrix = None
+        self._idf = None
+        return list(range(start, len(self.rows)))
+
+    def remove_documents(self, doc_ids: Sequence[int]):
+        for doc_id in set(doc_ids):
+            row = self.rows[doc_id]
+            if row is None:
+                continue
+            self.doc_freqs[row[0]] -= 1
+            self.rows[doc_id] = None
+            self.n_docs -= 1
+        self._matrix = None
+        self._idf = None
+
+    def _to_matrix(self, rows: Sequence[Optional[Tuple[np.ndarray, np.ndarray]]]) -> sparse.csr_matrix:
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indices, data = [], []
+        for i, row in enumerate(rows):
+            if row is not None:
+                indices.append(row[0])
+                data.append(row[1])
+            indptr[i + 1] = indptr[i] + (len(row[0]) if row is not None else 0)
+        matrix = sparse.csr_matrix(
+            (
+                np.concatenate(data) if data else np.zeros(0, dtype=np.float64),
+                np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+                indptr,
+            ),
+            shape=(len(rows), len(self.doc_freqs))
+        )
+        if not len(self.doc_freqs):
+            return matrix
+        matrix = matrix @ sparse.diags(self._cached_idf())
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+    def transform(self, texts: Sequence[np.ndarray]) -> sparse.csr_matrix:
+        """
+        Vectores TF-IDF (normalizados) de textos ya analizados (ids de
+        término); los términos fuera del vocabulario se ignoran.
+        """
+        idf = self._cached_idf()
+        indptr = [0]
+        indices, data = [], []
+        for term_ids in texts:
+            # Términos que solo aparecían en documentos eliminados se ignoran
+            counts = Counter(t for t in term_ids.tolist() if t < len(self.doc_freqs) and self.doc_freqs[t] > 0)
+            ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts)) * idf[ids]
+            norm = np.sqrt(weights @ weights)
+            indices.append(ids)
+            data.append(weights / norm if norm > 0 else weights)
+            indptr.append(indptr[-1] + len(ids))
+        return sparse.csr_matrix(
+            (
+                np.concatenate(data) if data else np.zeros(0, dtype=np.float64),
+                np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+                np.asarray(indptr, dtype=np.int64),
+            ),
+            shape=(len(texts), len(self.doc_freqs))
+        )
+
+    def document_matrix(self) -> sparse.csr_matrix:
+        """
+        Matriz documento-término TF-IDF del corpus (filas vacías para los
+        documentos eliminados). Se reconstruye solo tras un cambio.
+        """
+        if self._matrix is None:
+            self._matrix = self._to_matrix(self.rows)
+        return self._matrix
+
+    def similarity(self, query_vector: sparse.csr_matrix, doc_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Similitud coseno entre un vector de consulta (fila de `transform`) y
+        los documentos `doc_ids`, o todo el corpus si no se indican, con un
+        único producto disperso. Devuelve una puntuación por documento.
+        """
+        matrix = self.document_matrix()
+        if doc_ids is not None:
+            matrix = matrix[np.asarray(doc_ids, dtype=np.int64)]
+        # Las filas ya están normalizadas: el producto escalar es el coseno
+        return np.asarray((matrix @ query_vector.T).todense()).ravel()
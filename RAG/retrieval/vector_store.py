@@ -0,0 +1,520 @@
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import copy
+import glob
+import logging
+import os
+import tempfile
+
+import joblib
+import numpy as np
+from langchain.schema import Document
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+from config.settings import IVF_NLIST, IVF_NPROBE, VECTOR_MEMMAP_DTYPE, VECTOR_QUANTIZATION, VECTOR_RESCORE_CANDIDATES
+
+
+PositionLookup = Callable[[str], Optional[int]]
+
+
+class VectorStore(ABC):
+    """
+    Índice vectorial de un RetrievalSystem. Los fragmentos se identifican
+    por su posición en `RetrievalSystem.docs`, igual que en BM25L y TF-IDF,
+    y las búsquedas se restringen a los fragmentos de un rol.
+
+    `build(directory, embeddings, docs, position, prepare)` calcula los
+    embeddings de `docs` y llama a `prepare` (vaciar el directorio del
+    índice) antes de escribir nada en disco: si falla el modelo de
+    embeddings, el índice anterior sigue intacto.
+    """
+    @classmethod
+    @abstractmethod
+    def build(cls, directory: str, embeddings, docs: List[Document], position: PositionLookup,
+              prepare: Callable[[], None]) -> "VectorStore":
+        """Índice nuevo con `docs` (ver el contrato de `prepare` arriba)."""
+
+    @classmethod
+    @abstractmethod
+    def open(cls, directory: str, embeddings, position: PositionLookup) -> "VectorStore":
+        """Reabre el índice guardado en `directory`."""
+
+    @abstractmethod
+    def add_documents(self, docs: List[Document], positions: List[int]):
+        """Añade `docs` en las posiciones `positions` (al final de `docs`)."""
+
+    @abstractmethod
+    def delete(self, docs: List[Document], positions: List[int]):
+        """Elimina los fragmentos dados."""
+
+    @abstractmethod
+    def search(self, query: str, k: int, sources: Sequence[str],
+               allowed: Optional[np.ndarray] = None,
+               embedding: Optional[Sequence[float]] = None) -> List[Tuple[int, float]]:
+        """
+        (posición, relevancia) de mayor a menor relevancia. `embedding` es el
+        embedding de `query` si ya se calculó (caché de respuestas).
+        """
+
+    def save(self):
+        """Persiste el índice en su directorio (si no lo hace por sí mismo)."""
+
+    def is_consistent(self, n_docs: int) -> bool:
+        """
+        Indica si el índice reabierto corresponde a los `n_docs` fragmentos
+        guardados (un guardado interrumpido puede dejarlos desalineados).
+        """
+        return True
+
+    def copy(self) -> "VectorStore":
+        """
+        Copia que se puede modificar sin afectar a las búsquedas en curso.
+        Por defecto el propio índice: Chroma se actualiza en el sitio y sus
+        resultados se traducen a posiciones con el estado vigente.
+        """
+        return self
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    Colección de Chroma persistida en el directorio del índice.
+
+    Limitación: Chroma no se puede copiar, así que `copy` devuelve la misma
+    colección y las ingestas la modifican en el sitio antes de publicar el
+    snapshot nuevo. Un snapshot fijado puede recibir de Chroma fragmentos
+    aún no publicados (se descartan porque no tienen posición en ese
+    snapshot) y dejar de encontrar fragmentos ya eliminados del índice
+    vectorial. Solo los backends "exact" e "ivf" aíslan del todo cada
+    snapshot.
+    """
+    def __init__(self, chroma: Chroma, position: PositionLookup):
+        self.chroma = chroma
+        self.position = position
+
+    @classmethod
+    def build(cls, directory: str, embeddings, docs: List[Document], position: PositionLookup,
+              prepare: Callable[[], None]) -> "ChromaVectorStore":
+        vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+        prepare()
+        Chroma.from_documents(
+            documents=docs,
+            embedding=_PrecomputedEmbeddings(docs, vectors),
+            ids=[doc.metadata["chunk_id"] for doc in docs],
+            persist_directory=directory
+        )
+        return cls.open(directory, embeddings, position)
+
+    @classmethod
+    def open(cls, directory: str, embeddings, position: PositionLookup) -> "ChromaVectorStore":
+        return cls(Chroma(persist_directory=directory, embedding_function=embeddings), position)
+
+    def add_documents(self, docs: List[Document], positions: List[int]):
+        self.chroma.add_documents(docs, ids=[doc.metadata["chunk_id"] for doc in docs])
+
+    def delete(self, docs: List[Document], positions: List[int]):
+        self.chroma.delete(ids=[doc.metadata["chunk_id"] for doc in docs])
+
+    def search(self, query: str, k: int, sources: Sequence[str],
+               allowed: Optional[np.ndarray] = None,
+               embedding: Optional[Sequence[float]] = None) -> List[Tuple[int, float]]:
+        # Chroma embebe la consulta él mismo; con el mismo texto la caché LRU
+        # de CachedEmbeddings devuelve el embedding ya calculado
+        results = self.chroma.similarity_search_with_relevance_scores(
+            query, k=k, filter={"source": {"$in": list(sources)}}
+        )
+        positions = [(self.position(doc.metadata["chunk_id"]), score) for doc, score in results]
+        return [(position, score) for position, score in positions if position is not None]
+
+
+class _PrecomputedEmbeddings(Embeddings):
+    """Embeddings ya calculados de los fragmentos que se escriben en Chroma."""
+    def __init__(self, docs: List[Document], vectors: List[List[float]]):
+        self.vectors = {doc.page_content: vector for doc, vector in zip(docs, vectors)}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        raise NotImplementedError
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Embeddings normalizados en una matriz contigua (fila = posición en
+    `docs`) que se guarda en `VECTORS_FILE` y se reabre como memmap de solo
+    lectura: solo se leen de disco las filas que se consultan y los workers
+    que abren el mismo índice comparten esas páginas en la caché del sistema.
+
+    Añadir vectores a un memmap no lo carga en memoria: se copia por bloques
+    a un fichero nuevo junto con las filas nuevas (el memmap anterior lo
+    pueden seguir leyendo snapshots fijados) y `save` lo renombra a
+    `VECTORS_FILE`.
+    """
+    VECTORS_FILE = "vectors.npy"
+    ALIVE_FILE = "vectors_alive.npy"
+    # Ficheros de vectores ampliados que aún no se han guardado
+    PENDING_PREFIX = "vectors-pending-"
+    # Filas por bloque al copiar o convertir el memmap sin cargarlo entero
+    BLOCK_ROWS = 16384
+
+    def __init__(self, directory: str, embeddings, dtype: str = "float32"):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.dtype = np.dtype(dtype)
+        self.vectors = np.zeros((0, 0), dtype=self.dtype)
+        self.alive = np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.alive)
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def embed_documents(self, docs: List[Document]) -> np.ndarray:
+        return _unit_rows(self.embeddings.embed_documents([doc.page_content for doc in docs]))
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return _unit_rows(self.embeddings.embed_query(query))
+
+    def add_documents(self, docs: List[Document], positions: List[int]):
+        if not docs:
+            return
+        if positions[0] != len(self):
+            raise ValueError(f"Vectors must be appended in order: expected position {len(self)}, got {positions[0]}")
+        self.add_vectors(self.embed_documents(docs))
+
+    def add_vectors(self, vectors: np.ndarray):
+        vectors = vectors.astype(self.dtype, copy=False)
+        if len(self) == 0:
+            self.vectors = vectors
+        elif isinstance(self.vectors, np.memmap) and self.vectors.dtype == self.dtype:
+            self.vectors = self._extend_memmap(vectors)
+        else:
+            self.vectors = np.concatenate([self.vectors, vectors])
+        self.alive = np.concatenate([self.alive, np.ones(len(vectors), dtype=bool)])
+
+    def _extend_memmap(self, vectors: np.ndarray) -> np.memmap:
+        fd, path = tempfile.mkstemp(prefix=self.PENDING_PREFIX, suffix=".npy", dir=self.directory)
+        os.close(fd)
+        rows = len(self.vectors)
+        extended = np.lib.format.open_memmap(
+            path, mode="w+", dtype=self.dtype, shape=(rows + len(vectors), self.vectors.shape[1])
+        )
+        for start in range(0, rows, self.BLOCK_ROWS):
+            end = min(start + self.BLOCK_ROWS, rows)
+            extended[start:end] = self.vectors[start:end]
+        extended[rows:] = vectors
+        extended.flush()
+        del extended
+        return np.load(path, mmap_mode="r")
+
+    def delete(self, docs: List[Document], positions: List[int]):
+        self.alive[list(positions)] = False
+
+    def is_consistent(self, n_docs: int) -> bool:
+        return len(self.vectors) == len(self) == n_docs
+
+    def copy(self) -> "NumpyVectorStore":
+        # Añadir vectores crea arrays nuevos; solo `alive` se modifica en el sitio
+        clone = copy.copy(self)
+        clone.alive = self.alive.copy()
+        return clone
+
+    def _candidates(self, allowed: Optional[np.ndarray]) -> np.ndarray:
+        mask = self.alive if allowed is None else self.alive & allowed[:len(self)]
+        return np.flatnonzero(mask)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(self.VECTORS_FILE)
+        if isinstance(self.vectors, np.memmap) and self.vectors.dtype == self.dtype:
+            # Un memmap guardado no ha cambiado; uno ampliado ya está escrito
+            if os.path.abspath(self.vectors.filename) != os.path.abspath(path):
+                os.replace(self.vectors.filename, path)
+                self.vectors = np.load(path, mmap_mode="r")
+        else:
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(self.vectors, dtype=self.dtype))
+            os.replace(path + ".tmp", path)
+            self.vectors = np.load(path, mmap_mode="r")
+        np.save(self._path(self.ALIVE_FILE), self.alive)
+        # Ampliaciones intermedias o descartadas; los snapshots que aún las
+        # leen conservan su memmap abierto
+        for pending in glob.glob(self._path(self.PENDING_PREFIX + "*.npy")):
+            os.remove(pending)
+
+    def _load_vectors(self):
+        self.vectors = np.load(self._path(self.VECTORS_FILE), mmap_mode="r")
+        self.alive = np.load(self._path(self.ALIVE_FILE))
+        if self.vectors.dtype != self.dtype:
+            logging.info("Converting stored vectors from %s to %s", self.vectors.dtype, self.dtype)
+            self.vectors = np.asarray(self.vectors, dtype=self.dtype)
+
+
+class IVFVectorStore(NumpyVectorStore):
+    """
+    Índice aproximado IVF (inverted file): los vectores se agrupan con
+    k-means en `nlist` listas y cada consulta solo recorre las `nprobe`
+    listas con el centroide más parecido.
+
+    En memoria se guardan los vectores cuantizados (`quantization`: "int8",
+    4 veces menos que float32, o "fp16", 2 veces menos); los `rescore`
+    mejores candidatos aproximados se puntúan de nuevo con los vectores
+    float32 exactos del memmap.
+    """
+    STATE_FILE = "ivf.joblib"
+    KMEANS_ITERATIONS = 10
+    KMEANS_SAMPLE = 50000
+
+    def __init__(self, directory: str, embeddings, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 quantization: str = VECTOR_QUANTIZATION, rescore: int = VECTOR_RESCORE_CANDIDATES):
+        super().__init__(directory, embeddings)
+        if quantization not in ("int8", "fp16", "none"):
+            raise ValueError(f"Unknown vector quantization: {quantization}")
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.rescore = rescore
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.codes = None
+        self.scale = None
+        self._lists: List[np.ndarray] = []
+
+    @classmethod
+    def build(cls, directory: str, embeddings, docs: List[Document], position: PositionLookup,
+              prepare: Callable[[], None]) -> "IVFVectorStore":
+        store = cls(directory, embeddings)
+        store.train(store.embed_documents(docs))
+        # Los vectores solo se escriben al guardar
+        prepare()
+        return store
+
+    @classmethod
+    def open(cls, directory: str, embeddings, position: PositionLookup,
+             read_only: bool = False) -> "IVFVectorStore":
+        """`read_only`: si hay que reentrenar, el resultado no se guarda."""
+        store = cls(directory, embeddings)
+        store._load_vectors()
+        state = joblib.load(store._path(cls.STATE_FILE))
+        if (state["quantization"], state["nlist"]) != (store.quantization, store.nlist) or \
+                len(state["assignments"]) != len(store.vectors):
+            # Cambió la configuración (o el estado no corresponde a los vectores):
+            # se reentrena con los vectores guardados y se guarda, para no
+            # repetirlo en cada arranque ni mantener los float32 en memoria
+            logging.info("IVF parameters changed or state out of date; retraining from stored vectors")
+            alive = store.alive
+            store.train(np.asarray(store.vectors))
+            store.alive = alive
+            if not read_only:
+                store.save()
+            return store
+        store.centroids = state["centroids"]
+        store.assignments = state["assignments"]
+        store.codes = state["codes"]
+        store.scale = state["scale"]
+        store._build_lists()
+        return store
+
+    def train(self, vectors: np.ndarray):
+        """Agrupa `vectors` con k-means esférico y cuantiza todos los vectores."""
+        nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), self.KMEANS_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            centroids = _unit_rows(centroids)
+        self.centroids = centroids
+        if self.quantization == "int8":
+            self.scale = np.maximum(np.abs(vectors).max(axis=0), 1e-6).astype(np.float32) / 127
+        self.vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.codes = None
+        self.add_vectors(vectors)
+        logging.info("IVF index trained: %d vectors, %d lists, %s codes", len(vectors), nlist, self.quantization)
+
+    def _quantize(self, vectors: np.ndarray) -> Optional[np.ndarray]:
+        if self.quantization == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        if self.quantization == "fp16":
+            return vectors.astype(np.float16)
+        return None
+
+    def add_vectors(self, vectors: np.ndarray):
+        super().add_vectors(vectors)
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        self.assignments = np.concatenate([self.assignments, assignments])
+        codes = self._quantize(vectors)
+        if codes is not None:
+            self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+        self._build_lists()
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        offsets = np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))
+        self._lists = np.split(order, offsets[:-1])
+
+    def _approximate_scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if self.quantization == "int8":
+            return self.codes[rows].astype(np.float32) @ (query * self.scale)
+        if self.quantization == "fp16":
+            return self.codes[rows].astype(np.float32) @ query
+        return self.vectors[rows] @ query
+
+    def search(self, query: str, k: int, sources: Sequence[str],
+               allowed: Optional[np.ndarray] = None,
+               embedding: Optional[Sequence[float]] = None) -> List[Tuple[int, float]]:
+        query_vector = self.embed_query(query) if embedding is None else _unit_rows(embedding)
+        return self.search_vector(query_vector, k, allowed)
+
+    def search_vector(self, query: np.ndarray, k: int, allowed: Optional[np.ndarray] = None,
+                      nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        nprobe = nprobe or self.nprobe
+        mask = self.alive if allowed is None else self.alive & allowed[:len(self)]
+        candidates = []
+        found = 0
+        # Se amplía nprobe si las listas visitadas no tienen k fragmentos del rol
+        for probed, cluster in enumerate(np.argsort(-(self.centroids @ query)), start=1):
+            members = self._lists[cluster]
+            members = members[mask[members]]
+            candidates.append(members)
+            found += len(members)
+            if probed >= nprobe and found >= k:
+                break
+        rows = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+        if not len(rows):
+            return []
+        shortlist = max(self.rescore, k)
+        if len(rows) > shortlist:
+            approximate = self._approximate_scores(rows, query)
+            rows = rows[np.argpartition(-approximate, shortlist - 1)[:shortlist]]
+        # Rescoring exacto; las filas ordenadas leen el memmap de forma secuencial
+        rows = np.sort(rows)
+        exact = np.asarray(self.vectors[rows]) @ query
+        top = np.argsort(-exact)[:k]
+        return [(int(rows[i]), float(exact[i])) for i in top]
+
+    def exact_search(self, query: np.ndarray, k: int) -> List[int]:
+        """Búsqueda exhaustiva con los vectores float32 (referencia para recall)."""
+        rows = self._candidates(None)
+        scores = np.asarray(self.vectors[rows]) @ query
+        return [int(rows[i]) for i in np.argsort(-scores)[:k]]
+
+    def memory_bytes(self) -> int:
+        """Memoria residente del índice (códigos, centroides y listas)."""
+        codes = self.codes.nbytes if self.codes is not None else self.vectors.nbytes
+        return codes + self.centroids.nbytes + self.assignments.nbytes * 2 + self.alive.nbytes
+
+    def save(self):
+        super().save()
+        joblib.dump(
+            {
+                "quantization": self.quantization,
+                "nlist": self.nlist,
+                "centroids": self.centroids,
+                "assignments": self.assignments,
+                "codes": self.codes,
+                "scale": self.scale,
+            },
+            self._path(self.STATE_FILE)
+        )
+
+
+class ExactVectorStore(NumpyVectorStore):
+    """
+    Búsqueda exacta por fuerza bruta sobre el memmap de embeddings
+    (float32 o float16): un producto matriz-vector y `argpartition` para el
+    top-k. Para corpus de hasta unos 100k fragmentos es más rápida que
+    Chroma, sin cliente ni SQLite, y sus resultados son reproducibles.
+    """
+    def __init__(self, directory: str, embeddings, dtype: str = VECTOR_MEMMAP_DTYPE):
+        super().__init__(directory, embeddings, dtype)
+
+    @classmethod
+    def build(cls, directory: str, embeddings, docs: List[Document], position: PositionLookup,
+              prepare: Callable[[], None]) -> "ExactVectorStore":
+        store = cls(directory, embeddings)
+        store.add_vectors(store.embed_documents(docs))
+        prepare()
+        return store
+
+    @classmethod
+    def open(cls, directory: str, embeddings, position: PositionLookup) -> "ExactVectorStore":
+        store = cls(directory, embeddings)
+        store._load_vectors()
+        if not isinstance(store.vectors, np.memmap):
+            # Cambió VECTOR_MEMMAP_DTYPE: se guarda ya con el tipo nuevo
+            store.save()
+        return store
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+        # NumPy no usa BLAS con float16
+        return np.concatenate([
+            self.vectors[start:start + self.BLOCK_ROWS].astype(np.float32) @ query
+            for start in range(0, len(self), self.BLOCK_ROWS)
+        ]) if len(self) else np.zeros(0, dtype=np.float32)
+
+    def search(self, query: str, k: int, sources: Sequence[str],
+               allowed: Optional[np.ndarray] = None,
+               embedding: Optional[Sequence[float]] = None) -> List[Tuple[int, float]]:
+        query_vector = self.embed_query(query) if embedding is None else _unit_rows(embedding)
+        return self.search_vector(query_vector, k, allowed)
+
+    def search_vector(self, query: np.ndarray, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        mask = self.alive if allowed is None else self.alive & allowed[:len(self)]
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        scores = np.where(mask, self._scores(query), -np.inf)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+VECTOR_STORES: Dict[str, type] = {
+    "chroma": ChromaVectorStore,
+    "ivf": IVFVectorStore,
+    "exact": ExactVectorStore,
+}
+
+
+def vector_store_class(backend: str) -> type:
+    if backend not in VECTOR_STORES:
+        raise ValueError(f"Unknown vector backend: {backend}")
+    return VECTOR_STORES[backend]
+
+
+def recall_at_k(store: IVFVectorStore, queries: np.ndarray, k: int = 10, nprobe: Optional[int] = None,
+                exclude: Optional[Sequence[int]] = None) -> float:
+    """
+    Fracción media de los k vecinos exactos que devuelve la búsqueda
+    aproximada. `exclude[i]` es una fila que se ignora en la consulta i
+    (la propia fila cuando las consultas son vectores del índice).
+    """
+    hits = 0
+    total = 0
+    for i, query in enumerate(queries):
+        extra = 1 if exclude is not None else 0
+        truth = [row for row in store.exact_search(query, k + extra) if exclude is None or row != exclude[i]][:k]
+        found = {row for row, _ in store.search_vector(query, k + extra, nprobe=nprobe)}
+        if exclude is not None:
+            found.discard(exclude[i])
+        hits += len(found.intersection(truth))
+        total += len(truth)
+    return hits / total if total else 0.0
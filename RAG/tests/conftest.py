@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del servicio se importan desde la raíz de RAG, como al ejecutar api.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
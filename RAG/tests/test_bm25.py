@@ -0,0 +1,103 @@
+import unittest
+from collections import defaultdict
+
+import numpy as np
+
+from retrieval.bm25 import BM25LRetriever
+
+
+def reference_scores(corpus, query, k1, b, delta):
+    """BM25L original (recorría todo el corpus por consulta); referencia de las puntuaciones."""
+    doc_len = [len(doc.split()) for doc in corpus]
+    avg_doc_len = sum(doc_len) / len(corpus)
+    doc_freqs = []
+    idf = defaultdict(float)
+    for document in corpus:
+        freqs = defaultdict(int)
+        for word in document.split():
+            freqs[word] += 1
+        doc_freqs.append(freqs)
+        for word in freqs:
+            idf[word] += 1
+    for word, freq in idf.items():
+        idf[word] = np.log((len(corpus) - freq + 0.5) / (freq + 0.5))
+
+    scores = [0.0] * len(corpus)
+    for i in range(len(corpus)):
+        for word in query.split():
+            if word not in doc_freqs[i]:
+                continue
+            freq = doc_freqs[i][word]
+            numerator = idf[word] * freq * (k1 + 1)
+            denominator = freq + k1 * (1 - b + b * doc_len[i] / avg_doc_len)
+            scores[i] += numerator / denominator + delta
+    return scores
+
+
+class BM25LParityTests(unittest.TestCase):
+    K1, B, DELTA = 1.2, 0.75, 0.5
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        words = [f"w{i}" for i in range(60)]
+        # Distribución sesgada: términos muy frecuentes (IDF negativo) y raros
+        weights = 1 / np.arange(1, len(words) + 1)
+        weights /= weights.sum()
+        self.corpus = [
+            " ".join(rng.choice(words, size=rng.integers(1, 40), p=weights)) for _ in range(120)
+        ]
+        self.queries = [" ".join(rng.choice(words, size=rng.integers(1, 6))) for _ in range(25)]
+        self.queries.append("w0 w0 w3 desconocida")
+        self.vocabulary = {word: i for i, word in enumerate(words)}
+
+    def encode(self, text):
+        return np.asarray([self.vocabulary[w] for w in text.split() if w in self.vocabulary], dtype=np.int32)
+
+    def retriever(self, corpus, backend):
+        return BM25LRetriever([self.encode(doc) for doc in corpus], k1=self.K1, b=self.B, delta=self.DELTA,
+                              backend=backend)
+
+    def test_scores_match_reference(self):
+        for backend in ("postings", "sparse"):
+            retriever = self.retriever(self.corpus, backend)
+            for query in self.queries:
+                expected = reference_scores(self.corpus, query, self.K1, self.B, self.DELTA)
+                np.testing.assert_allclose(retriever.bm25.get_scores(self.encode(query)), expected,
+                                           rtol=1e-9, atol=1e-9, err_msg=f"{backend}: {query}")
+
+    def test_top_k_matches_reference(self):
+        for backend in ("postings", "sparse"):
+            retriever = self.retriever(self.corpus, backend)
+            batch = retriever.retrieve_batch([self.encode(query) for query in self.queries], top_k=5)
+            for query, results in zip(self.queries, batch):
+                expected = reference_scores(self.corpus, query, self.K1, self.B, self.DELTA)
+                self.assertEqual(results, retriever.retrieve(self.encode(query), top_k=5))
+                for doc_id, score in results:
+                    self.assertAlmostEqual(score, expected[doc_id])
+
+    def test_incremental_updates_match_rebuild(self):
+        for backend in ("postings", "sparse"):
+            retriever = self.retriever(self.corpus[:80], backend)
+            retriever.add_documents([self.encode(doc) for doc in self.corpus[80:]])
+            removed = list(range(0, 120, 7))
+            retriever.remove_documents(removed)
+            remaining = [doc for i, doc in enumerate(self.corpus) if i not in removed]
+            ids = [i for i in range(len(self.corpus)) if i not in removed]
+            for query in self.queries:
+                scores = np.asarray(retriever.bm25.get_scores(self.encode(query)))
+                expected = reference_scores(remaining, query, self.K1, self.B, self.DELTA)
+                np.testing.assert_allclose(scores[ids], expected, rtol=1e-9, atol=1e-9)
+                self.assertTrue(np.all(scores[removed] == 0))
+
+    def test_with_backend_keeps_scores(self):
+        postings = self.retriever(self.corpus, "postings")
+        sparse = postings.with_backend("sparse")
+        self.assertEqual(sparse.backend, "sparse")
+        self.assertEqual(sparse.with_backend("postings").backend, "postings")
+        for query in self.queries:
+            np.testing.assert_allclose(sparse.bm25.get_scores(self.encode(query)),
+                                       postings.bm25.get_scores(self.encode(query)), rtol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+import api
+from models import backends, ollama_client
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Servidor de Ollama mínimo: responde a /api/generate y guarda cada petición."""
+    requests = []
+    failures = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubOllama.requests.append((self.path, body))
+        if StubOllama.failures > 0:
+            StubOllama.failures -= 1
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "model is loading"}')
+            return
+        chunk = {"model": body["model"], "created_at": "2024-01-01T00:00:00Z", "response": "Hola", "done": True}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if body.get("stream") else "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(chunk).encode("utf-8") + b"\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class OllamaWarmupTests(unittest.TestCase):
+    def setUp(self):
+        StubOllama.requests = []
+        StubOllama.failures = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.patches = [
+            mock.patch.object(ollama_client, "LLAMA_BASE_URL", base_url),
+            mock.patch.object(ollama_client, "OLLAMA_KEEP_ALIVE", "45m"),
+            mock.patch.object(ollama_client, "_clients", None),
+            mock.patch.object(backends, "LLAMA_BASE_URL", base_url),
+            mock.patch.object(backends, "OLLAMA_KEEP_ALIVE", "45m"),
+            mock.patch.object(api, "LLM_WARMUP_RETRY_SECONDS", 0.01),
+            mock.patch.dict(api.warmup_state, {"ready": False, "error": None}),
+            # /health solo necesita saber que la aplicación arrancó
+            mock.patch.object(api, "rag_app", object()),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_warm_up_generates_one_token_with_keep_alive(self):
+        asyncio.run(ollama_client.warm_up("llama3.2"))
+
+        self.assertEqual(len(StubOllama.requests), 1)
+        path, body = StubOllama.requests[0]
+        self.assertEqual(path, "/api/generate")
+        self.assertEqual(body["model"], "llama3.2")
+        self.assertEqual(body["keep_alive"], "45m")
+        self.assertEqual(body["options"]["num_predict"], 1)
+        self.assertEqual(body["options"]["num_ctx"], ollama_client.OLLAMA_NUM_CTX)
+
+    def test_llm_uses_base_url_and_keep_alive(self):
+        llm = backends.create_llm("llama3.2")
+
+        self.assertEqual(llm.invoke("Hola"), "Hola")
+        path, body = StubOllama.requests[-1]
+        self.assertEqual(path, "/api/generate")
+        self.assertEqual(body["keep_alive"], "45m")
+        self.assertEqual(body["options"]["num_ctx"], backends.OLLAMA_NUM_CTX)
+        self.assertEqual(body["options"]["num_predict"], backends.LLM_MAX_OUTPUT_TOKENS)
+        # El pool se configura con la API pública de OllamaLLM, no con sus clientes privados
+        self.assertEqual(set(llm.client_kwargs), {"limits", "timeout"})
+
+    def test_health_turns_ready_after_warm_up_retries(self):
+        client = TestClient(api.app)
+        StubOllama.failures = 2
+
+        response = client.get("/health")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "STARTING")
+
+        asyncio.run(api.warm_up_llm("llama3.2"))
+
+        self.assertEqual(len(StubOllama.requests), 3)
+        response = client.get("/health")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "OK"})
+
+
+if __name__ == "__main__":
+    unittest.main()
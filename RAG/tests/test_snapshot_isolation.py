@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+
+from retrieval import retrieval_system
+from retrieval.index_store import IndexStore
+from retrieval.retrieval_system import RetrievalSystem
+
+
+class HashEmbeddings(Embeddings):
+    """Embeddings deterministas a partir del texto (sin modelo)."""
+    def _embed(self, text):
+        return np.random.default_rng(zlib.crc32(text.encode())).normal(size=16).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def make_chunks(source, n, tag):
+    return [
+        Document(
+            page_content=f"{tag} salario bono {i % 5} texto {source} {i}",
+            metadata={"source": source, "chunk_id": f"{source}-{tag}-{i}"}
+        )
+        for i in range(n)
+    ]
+
+
+class SnapshotIsolationTests(unittest.TestCase):
+    """Una vista fijada con `pin` no ve las ingestas posteriores."""
+    QUERY = "salario bono 3"
+
+    def build(self, backend):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = [
+            mock.patch.object(retrieval_system, "INDEX_DIRECTORY", directory.name),
+            mock.patch.object(retrieval_system, "VECTOR_BACKEND", backend),
+            mock.patch.object(RetrievalSystem, "_create_embeddings", staticmethod(HashEmbeddings)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        manifest = IndexStore.build_manifest([], 1000, 200, "hash", backend)
+        system = RetrievalSystem(make_chunks("a.pdf", 40, "v0") + make_chunks("b.pdf", 40, "v0"), manifest=manifest)
+        self.assertIsNotNone(system.vectorstore)
+        return system, system.for_role("r", ["a.pdf", "b.pdf"])
+
+    def results(self, view):
+        return (
+            [(doc.metadata["chunk_id"], score) for doc, score in view.vector_search(self.QUERY)],
+            [(view.docs[idx].metadata["chunk_id"], score) for idx, score in view.bm25l_search(self.QUERY)],
+            [doc.metadata["chunk_id"] for doc in view.keyword_search(self.QUERY)],
+        )
+
+    def check_backend(self, backend):
+        system, view = self.build(backend)
+        pinned = view.pin()
+        before = self.results(pinned)
+
+        system.upsert_document("a.pdf", make_chunks("a.pdf", 30, "v1"), "a1")
+        system.remove_document("b.pdf")
+
+        self.assertEqual(self.results(pinned), before)
+        current = self.results(view.pin())
+        for ids in current:
+            for item in ids:
+                chunk_id = item[0] if isinstance(item, tuple) else item
+                self.assertTrue(chunk_id.startswith("a.pdf-v1-"), chunk_id)
+
+    def test_exact(self):
+        self.check_backend("exact")
+
+    def test_ivf(self):
+        self.check_backend("ivf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from retrieval.vector_store import ExactVectorStore, IVFVectorStore, _unit_rows, recall_at_k
+
+
+def clustered_vectors(n, dim=32, clusters=16, seed=0):
+    """Vectores unitarios agrupados alrededor de `clusters` centros, como los embeddings reales."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return _unit_rows(centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim)))
+
+
+class IVFRecallTests(unittest.TestCase):
+    """El índice IVF frente a la búsqueda exhaustiva con float32."""
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.vectors = clustered_vectors(2000)
+        self.queries = self.vectors[::50]
+        self.exclude = np.arange(0, len(self.vectors), 50)
+        self.store = IVFVectorStore(directory.name, None, nlist=32, nprobe=4, quantization="int8", rescore=50)
+        self.store.train(self.vectors)
+
+    def test_recall_with_default_nprobe(self):
+        self.assertGreaterEqual(recall_at_k(self.store, self.queries, k=10, exclude=self.exclude), 0.9)
+
+    def test_recall_grows_with_nprobe(self):
+        recalls = [recall_at_k(self.store, self.queries, k=10, nprobe=nprobe, exclude=self.exclude)
+                   for nprobe in (1, 4, 32)]
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertGreaterEqual(recalls[-1], 0.98)
+
+    def test_matches_exact_store(self):
+        exact = ExactVectorStore(self.store.directory, None, dtype="float32")
+        exact.add_vectors(self.vectors)
+        for query in self.queries:
+            truth = [row for row, _ in exact.search_vector(query, 10)]
+            self.assertEqual(self.store.exact_search(query, 10), truth)
+
+
+class MemmapAppendTests(unittest.TestCase):
+    """Añadir vectores a un índice guardado no modifica el memmap vigente."""
+    def test_append_to_saved_memmap(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        vectors = clustered_vectors(300, seed=1)
+        store = ExactVectorStore(directory.name, None, dtype="float32")
+        store.add_vectors(vectors[:200])
+        store.save()
+        self.assertIsInstance(store.vectors, np.memmap)
+
+        published = store.copy()
+        store.add_vectors(vectors[200:250])
+        store.add_vectors(vectors[250:])
+        self.assertIsInstance(store.vectors, np.memmap)
+        np.testing.assert_array_equal(store.vectors, vectors.astype(np.float32))
+        self.assertEqual(len(published.vectors), 200)
+
+        store.save()
+        self.assertEqual(glob.glob(os.path.join(directory.name, ExactVectorStore.PENDING_PREFIX + "*")), [])
+        reopened = ExactVectorStore.open(directory.name, None, position=lambda chunk_id: None)
+        np.testing.assert_array_equal(reopened.vectors, vectors.astype(np.float32))
+        np.testing.assert_array_equal(published.vectors, vectors[:200].astype(np.float32))
+
+
+if __name__ == "__main__":
+    unittest.main()
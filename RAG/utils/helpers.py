@@ -1,5 +1,6 @@
 import logging
 import json
+import hashlib
 
 def load_json(filepath: str):
     """
@@ -20,4 +21,14 @@ def save_json(data: dict, filepath: str):
         with open(filepath, 'w') as f:
             json.dump(data, f, indent=4)
     except Exception as e:
-        logging.error("Error guardando JSON en %s: %s", filepath, str(e))
\ No newline at end of file
+        logging.error("Error guardando JSON en %s: %s", filepath, str(e))
+
+def sha256_file(filepath: str, block_size: int = 1 << 20) -> str:
+    """
+    Calcula el hash SHA-256 del contenido de un archivo.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,54 @@
+from typing import Optional
+import logging
+
+from config.settings import CONTEXT_TOKENIZER
+
+
+class TokenCounter:
+    """
+    Cuenta y recorta tokens con el tokenizador de Hugging Face indicado o,
+    si no hay ninguno o no se puede cargar, con una estimación de ~4
+    caracteres por token.
+    """
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, tokenizer_name: str = CONTEXT_TOKENIZER):
+        self.tokenizer = None
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                logging.warning("Tokenizer %s unavailable, estimating tokens: %s", tokenizer_name, str(e))
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return max(1, len(text) // self.CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int, keep_end: bool = False) -> str:
+        """Recorta `text` a `max_tokens` conservando el principio (o el final)."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            if len(ids) <= max_tokens:
+                return text
+            ids = ids[-max_tokens:] if keep_end else ids[:max_tokens]
+            return self.tokenizer.decode(ids)
+        max_chars = max_tokens * self.CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        return text[-max_chars:] if keep_end else text[:max_chars]
+
+
+_token_counter: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter()
+    return _token_counter
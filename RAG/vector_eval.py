@@ -0,0 +1,70 @@
+"""
+Evaluación del índice vectorial aproximado (VECTOR_BACKEND=ivf): recall@k
+frente a la búsqueda exhaustiva con float32, latencia por consulta y
+memoria por fragmento para varios valores de nprobe.
+
+    python vector_eval.py [--k 10] [--queries 200] [--nprobe 1 2 4 8 16]
+    python vector_eval.py --questions preguntas.txt
+
+Sin --questions se usan como consultas vectores de fragmentos del índice,
+excluyendo el propio fragmento de los resultados.
+
+El índice se abre en solo lectura: no se sincroniza con los PDFs ni se
+reconstruye, y no se escribe nada en INDEX_DIRECTORY.
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from config.settings import EMBEDDING_MODEL, INDEX_DIRECTORY, IVF_NPROBE
+from models.registry import get_embeddings
+from retrieval.index_store import IndexStore
+from retrieval.vector_store import IVFVectorStore, recall_at_k
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall@k of the approximate vector index")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="Index vectors used as queries")
+    parser.add_argument("--questions", help="Text file with one question per line")
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[1, 2, 4, 8, 16, IVF_NPROBE])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = IndexStore(INDEX_DIRECTORY).stored_manifest()
+    if not manifest:
+        raise SystemExit(f"No index in {INDEX_DIRECTORY}: start the API or run ingest.py to build it")
+    backend = manifest.get("vector_backend")
+    if backend != "ivf":
+        raise SystemExit(f"The index in {INDEX_DIRECTORY} uses VECTOR_BACKEND={backend}, not the approximate "
+                         "index; rebuild it with VECTOR_BACKEND=ivf to evaluate it")
+    # El modelo de embeddings solo hace falta para embeber las preguntas
+    embeddings = get_embeddings(EMBEDDING_MODEL) if args.questions else None
+    store = IVFVectorStore.open(INDEX_DIRECTORY, embeddings, position=lambda chunk_id: None, read_only=True)
+
+    exclude = None
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            queries = np.vstack([store.embed_query(line.strip()) for line in f if line.strip()])
+    else:
+        rows = np.flatnonzero(store.alive)
+        exclude = np.sort(np.random.default_rng(0).choice(rows, min(args.queries, len(rows)), replace=False))
+        queries = np.asarray(store.vectors[exclude])
+
+    chunks = int(store.alive.sum())
+    print(f"{chunks} chunks, {len(store.centroids)} lists, {store.quantization} codes")
+    print(f"memory per chunk: {store.memory_bytes() / len(store):.0f} bytes "
+          f"(float32: {store.vectors.shape[1] * 4} bytes)")
+    for nprobe in sorted(set(args.nprobe)):
+        started = time.perf_counter()
+        for query in queries:
+            store.search_vector(query, args.k, nprobe=nprobe)
+        elapsed = (time.perf_counter() - started) / len(queries)
+        recall = recall_at_k(store, queries, k=args.k, nprobe=nprobe, exclude=exclude)
+        print(f"nprobe={nprobe:<4} recall@{args.k}={recall:.3f}  {elapsed * 1000:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()